@@ -1,5 +1,22 @@
 import base58
 
+SERVICE_FIELDS = ("id", "service_type", "endpoint")
+METADATA_FIELDS = ("key", "value")
+
+
+def _to_bytes(value) -> bytes:
+    if isinstance(value, (bytes, bytearray)):
+        return value
+    if isinstance(value, str) and value.startswith("0x"):
+        return bytes.fromhex(value[2:])
+    return bytes(value)
+
+
+def _decode_utf8(value) -> str:
+    if isinstance(value, str) and not value.startswith("0x"):
+        return value
+    return _to_bytes(value).decode("utf-8", errors="replace")
+
 
 def did_to_document(did: str, details: dict) -> dict:
     role_map = {
@@ -9,24 +26,14 @@ def did_to_document(did: str, details: dict) -> dict:
         "CapabilityInvocation": "capabilityInvocation",
         "CapabilityDelegation": "capabilityDelegation",
     }
-    services = []
-    for service in details.get("services", []):
-        services.append(
-            {
-                "id": bytes(service["id"]).decode("utf-8", errors="replace"),
-                "service_type": bytes(service["service_type"]).decode("utf-8", errors="replace"),
-                "endpoint": bytes(service["endpoint"]).decode("utf-8", errors="replace"),
-            }
-        )
-
-    metadata = []
-    for item in details.get("metadata", []):
-        metadata.append(
-            {
-                "key": bytes(item["key"]).decode("utf-8", errors="replace"),
-                "value": bytes(item["value"]).decode("utf-8", errors="replace"),
-            }
-        )
+    services = [
+        {field: _decode_utf8(service[field]) for field in SERVICE_FIELDS}
+        for service in details.get("services", [])
+    ]
+    metadata = [
+        {field: _decode_utf8(item[field]) for field in METADATA_FIELDS}
+        for item in details.get("metadata", [])
+    ]
 
     doc = {
         "@context": ["https://www.w3.org/ns/did/v1"],
@@ -44,7 +51,7 @@ def did_to_document(did: str, details: dict) -> dict:
     }
     for index, key in enumerate(details.get("keys", []), start=1):
         key_id = f"{did}#keys-{index}"
-        public_key_bytes = bytes(key["public_key"])
+        public_key_bytes = _to_bytes(key["public_key"])
         public_key_multibase = "z" + base58.b58encode(public_key_bytes).decode("ascii")
         vm = {
             "id": key_id,
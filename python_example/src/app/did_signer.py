@@ -0,0 +1,41 @@
+import ctypes.util
+import os
+
+from pqcrypto.sign.ml_dsa_44 import SECRET_KEY_SIZE, sign
+
+from app.parallel import parallel_map
+
+OQS_ML_DSA_44 = "ML-DSA-44"
+
+
+def _load_oqs():
+    if not (ctypes.util.find_library("oqs") or os.getenv("OQS_INSTALL_PATH")):
+        return None
+    try:
+        import oqs
+    except ImportError:
+        return None
+    if OQS_ML_DSA_44 not in oqs.get_enabled_sig_mechanisms():
+        return None
+    return oqs
+
+
+_OQS = _load_oqs()
+
+
+class DidSigner:
+    def __init__(self, private_key: bytes):
+        if len(private_key) != SECRET_KEY_SIZE:
+            raise ValueError(f"ML-DSA-44 private key must be {SECRET_KEY_SIZE} bytes")
+        self._private_key = bytes(private_key)
+        self._oqs_signature = None
+        if _OQS is not None:
+            self._oqs_signature = _OQS.Signature(OQS_ML_DSA_44, self._private_key)
+
+    def sign(self, payload: bytes) -> bytes:
+        if self._oqs_signature is not None:
+            return self._oqs_signature.sign(bytes(payload))
+        return sign(self._private_key, bytes(payload))
+
+    def sign_many(self, payloads: list[bytes]) -> list[bytes]:
+        return parallel_map(self.sign, payloads)
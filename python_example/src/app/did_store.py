@@ -1,36 +1,62 @@
 import base64
+import hashlib
 import json
 import os
+from collections import OrderedDict
 from getpass import getpass
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
 
 LOG_OK = "✅"
+KDF_PBKDF2_SHA256 = "pbkdf2_sha256_390000"
+KDF_SCRYPT = "scrypt_n32768_r8_p1"
+DEFAULT_KDF = KDF_SCRYPT
+KDF_KEY_CACHE_SIZE = 4
 
+_KDF_KEY_CACHE: OrderedDict[tuple[bytes, bytes, str], bytes] = OrderedDict()
 
-def encrypt_private_key(private_key: bytes, password: str, salt: bytes) -> str:
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=390000,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password.encode("utf-8")))
-    fernet = Fernet(key)
+
+def _create_kdf(kdf: str, salt: bytes):
+    if kdf == KDF_SCRYPT:
+        return Scrypt(salt=salt, length=32, n=2**15, r=8, p=1)
+    if kdf == KDF_PBKDF2_SHA256:
+        return PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=390000,
+        )
+    raise ValueError(f"Unsupported DID store KDF: {kdf}")
+
+
+def _derive_kdf_key(password: str, salt: bytes, kdf: str) -> bytes:
+    cache_key = (salt, hashlib.sha256(password.encode("utf-8")).digest(), kdf)
+    key = _KDF_KEY_CACHE.get(cache_key)
+    if key is not None:
+        _KDF_KEY_CACHE.move_to_end(cache_key)
+        return key
+    key = base64.urlsafe_b64encode(_create_kdf(kdf, salt).derive(password.encode("utf-8")))
+    _KDF_KEY_CACHE[cache_key] = key
+    if len(_KDF_KEY_CACHE) > KDF_KEY_CACHE_SIZE:
+        _KDF_KEY_CACHE.popitem(last=False)
+    return key
+
+
+def encrypt_private_key(private_key: bytes, password: str, salt: bytes, kdf: str = DEFAULT_KDF) -> str:
+    fernet = Fernet(_derive_kdf_key(password, salt, kdf))
     return fernet.encrypt(private_key).decode("ascii")
 
 
-def decrypt_private_key(encrypted_private_key: str, password: str, salt: bytes) -> bytes:
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=32,
-        salt=salt,
-        iterations=390000,
-    )
-    key = base64.urlsafe_b64encode(kdf.derive(password.encode("utf-8")))
-    fernet = Fernet(key)
+def decrypt_private_key(
+    encrypted_private_key: str,
+    password: str,
+    salt: bytes,
+    kdf: str = DEFAULT_KDF,
+) -> bytes:
+    fernet = Fernet(_derive_kdf_key(password, salt, kdf))
     return fernet.decrypt(encrypted_private_key.encode("ascii"))
 
 
@@ -40,13 +66,13 @@ def store_did_keys(did: str, public_key: bytes, private_key: bytes) -> None:
     if not password:
         password = getpass("DID store password: ")
     salt = os.urandom(16)
-    encrypted_private_key = encrypt_private_key(private_key, password, salt)
+    encrypted_private_key = encrypt_private_key(private_key, password, salt, DEFAULT_KDF)
     record = {
         "did": did,
         "public_key_hex": public_key.hex(),
         "private_key_enc": encrypted_private_key,
         "salt_hex": salt.hex(),
-        "kdf": "pbkdf2_sha256_390000",
+        "kdf": DEFAULT_KDF,
     }
     with open(store_path, "w", encoding="utf-8") as f:
         json.dump(record, f, indent=2)
@@ -63,7 +89,8 @@ def load_did_keys() -> tuple[str, bytes, bytes] | None:
     with open(store_path, "r", encoding="utf-8") as f:
         record = json.load(f)
     salt = bytes.fromhex(record["salt_hex"])
-    private_key = decrypt_private_key(record["private_key_enc"], password, salt)
+    kdf = record.get("kdf", KDF_PBKDF2_SHA256)
+    private_key = decrypt_private_key(record["private_key_enc"], password, salt, kdf)
     public_key = bytes.fromhex(record["public_key_hex"])
     did = record["did"]
     print(f"{LOG_OK} DID keypair loaded from {store_path}")
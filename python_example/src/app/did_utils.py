@@ -1,17 +1,77 @@
-import base58
+import ctypes
+import ctypes.util
+import functools
 import hashlib
 
+try:
+    from based58 import b58encode as _b58encode_digest
+except ImportError:
+    from base58 import b58encode as _b58encode_digest
+
+
+def _load_libb2():
+    path = ctypes.util.find_library("b2")
+    if not path:
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+        blake2b = lib.blake2b
+    except (OSError, AttributeError):
+        return None
+    blake2b.argtypes = [
+        ctypes.c_char_p,
+        ctypes.c_char_p,
+        ctypes.c_char_p,
+        ctypes.c_size_t,
+        ctypes.c_size_t,
+        ctypes.c_size_t,
+    ]
+    blake2b.restype = ctypes.c_int
+    return blake2b
+
+
+_LIBB2_BLAKE2B = _load_libb2()
+
+
+def _blake2b32(data: bytes) -> bytes:
+    if _LIBB2_BLAKE2B is None:
+        return hashlib.blake2b(data, digest_size=32).digest()
+    out = ctypes.create_string_buffer(32)
+    if _LIBB2_BLAKE2B(out, data, None, 32, len(data), 0) != 0:
+        raise RuntimeError("libb2 blake2b failed")
+    return out.raw
+
+
+@functools.lru_cache(maxsize=4)
+def _prefix_bytes(prefix: bytes, genesis_hash_hex: str) -> bytes:
+    return prefix + bytes.fromhex(genesis_hash_hex.removeprefix("0x"))
+
+
+@functools.lru_cache(maxsize=4)
+def _prefix_state(prefix: bytes, genesis_hash_hex: str):
+    state = hashlib.blake2b(digest_size=32)
+    state.update(_prefix_bytes(prefix, genesis_hash_hex))
+    return state
+
+
+def _prefixed_blake2b32(prefix: bytes, genesis_hash_hex: str, data: bytes) -> bytes:
+    if _LIBB2_BLAKE2B is not None:
+        return _blake2b32(_prefix_bytes(prefix, genesis_hash_hex) + data)
+    state = _prefix_state(prefix, genesis_hash_hex).copy()
+    state.update(data)
+    return state.digest()
+
 
 def derive_did_id(genesis_hash_hex: str, public_key: bytes) -> str:
-    genesis_bytes = bytes.fromhex(genesis_hash_hex.removeprefix("0x"))
-    material = b"QSB_DID" + genesis_bytes + public_key
-    did_id_bytes = hashlib.blake2b(material, digest_size=32).digest()
-    return base58.b58encode(did_id_bytes).decode("ascii")
+    did_id_bytes = _prefixed_blake2b32(b"QSB_DID", genesis_hash_hex, public_key)
+    return _b58encode_digest(did_id_bytes).decode("ascii")
+
+
+def derive_did_ids_batch(genesis_hash_hex: str, public_keys: list[bytes]) -> list[str]:
+    return [derive_did_id(genesis_hash_hex, public_key) for public_key in public_keys]
 
 
 def derive_schema_id(genesis_hash_hex: str, schema_json: bytes) -> str:
-    genesis_bytes = bytes.fromhex(genesis_hash_hex.removeprefix("0x"))
-    material = b"QSB_SCHEMA" + genesis_bytes + schema_json
-    schema_id_bytes = hashlib.blake2b(material, digest_size=32).digest()
-    schema_id_b58 = base58.b58encode(schema_id_bytes).decode("ascii")
+    schema_id_bytes = _prefixed_blake2b32(b"QSB_SCHEMA", genesis_hash_hex, schema_json)
+    schema_id_b58 = _b58encode_digest(schema_id_bytes).decode("ascii")
     return f"did:qsb:schema:{schema_id_b58}"
@@ -1,34 +1,29 @@
 import argparse
 import json
 import os
+import sys
 from getpass import getpass
+from typing import TYPE_CHECKING
 from uuid import uuid4
 
 from dotenv import load_dotenv
-from pqcrypto.sign.ml_dsa_44 import generate_keypair, sign
-from substrateinterface import Keypair
+from pqcrypto.sign.ml_dsa_44 import PUBLIC_KEY_SIZE, generate_keypair
 
 from app.did_resolver import resolve_did
+from app.did_signer import DidSigner
 from app.did_store import load_did_keys, store_did_keys
-from app.substrate_client import (
-    add_key,
-    add_service,
-    create_did,
-    create_substrate,
-    deactivate_did,
-    deprecate_schema,
-    get_free_balance,
-    register_schema,
-    remove_metadata,
-    remove_service,
-    revoke_key,
-    rotate_key,
-    set_metadata,
-    update_roles,
-)
+from app.scale import scale_compact_u32
 from app.did_utils import derive_did_id, derive_schema_id
 from app.tx_logger import log_receipt
 
+if TYPE_CHECKING:
+    from substrateinterface import Keypair
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 LOG_OK = "✅"
 LOG_WARN = "⚠️"
 LOG_DID = "🪪"
@@ -59,26 +54,37 @@ KEY_ROLE_INDEX = {
     "CapabilityInvocation": 3,
     "CapabilityDelegation": 4,
 }
+_ROLE_BYTE = {role: bytes([index]) for role, index in KEY_ROLE_INDEX.items()}
+
+
+_COMPACT_SMALL = tuple(scale_compact_u32(value) for value in range(1 << 6))
+_COMPACT_PUBLIC_KEY = scale_compact_u32(PUBLIC_KEY_SIZE)
+
+
+def _compact_len(length: int) -> bytes:
+    if length < 1 << 6:
+        return _COMPACT_SMALL[length]
+    if length == PUBLIC_KEY_SIZE:
+        return _COMPACT_PUBLIC_KEY
+    return scale_compact_u32(length)
 
 
-def _scale_compact_u32(value: int) -> bytes:
-    if value < 1 << 6:
-        return bytes([(value << 2) & 0xFF])
-    if value < 1 << 14:
-        encoded = (value << 2) | 0b01
-        return encoded.to_bytes(2, "little")
-    if value < 1 << 30:
-        encoded = (value << 2) | 0b10
-        return encoded.to_bytes(4, "little")
-    raise ValueError("Compact SCALE length too large")
+def _build_payload(prefix: bytes, *fields: bytes, roles: list[str] | None = None) -> bytes:
+    parts = [prefix]
+    for field in fields:
+        parts.append(_compact_len(len(field)))
+        parts.append(field)
+    if roles is not None:
+        parts.append(_scale_roles(roles))
+    return b"".join(parts)
 
 
-def _scale_vec_u8(data: bytes) -> bytes:
-    return _scale_compact_u32(len(data)) + data
+def _scale_roles(roles: list[str]) -> bytes:
+    return _compact_len(len(roles)) + b"".join([_ROLE_BYTE[role] for role in roles])
 
 
 def build_create_did_payload(public_key: bytes) -> bytes:
-    return DID_CREATE_PREFIX + _scale_vec_u8(public_key)
+    return _build_payload(DID_CREATE_PREFIX, public_key)
 
 
 def build_add_service_payload(
@@ -87,43 +93,27 @@ def build_add_service_payload(
     service_type: bytes,
     endpoint: bytes,
 ) -> bytes:
-    service_encoded = (
-        _scale_vec_u8(service_id) + _scale_vec_u8(service_type) + _scale_vec_u8(endpoint)
-    )
-    return DID_ADD_SERVICE_PREFIX + _scale_vec_u8(did_id) + service_encoded
+    return _build_payload(DID_ADD_SERVICE_PREFIX, did_id, service_id, service_type, endpoint)
 
 
 def build_remove_service_payload(did_id: bytes, service_id: bytes) -> bytes:
-    return DID_REMOVE_SERVICE_PREFIX + _scale_vec_u8(did_id) + _scale_vec_u8(service_id)
-
-
-def _scale_roles(roles: list[str]) -> bytes:
-    encoded = bytearray(_scale_compact_u32(len(roles)))
-    for role in roles:
-        index = KEY_ROLE_INDEX[role]
-        encoded.append(index)
-    return bytes(encoded)
+    return _build_payload(DID_REMOVE_SERVICE_PREFIX, did_id, service_id)
 
 
 def build_add_key_payload(did_id: bytes, public_key: bytes, roles: list[str]) -> bytes:
-    return (
-        DID_ADD_KEY_PREFIX
-        + _scale_vec_u8(did_id)
-        + _scale_vec_u8(public_key)
-        + _scale_roles(roles)
-    )
+    return _build_payload(DID_ADD_KEY_PREFIX, did_id, public_key, roles=roles)
 
 
 def build_revoke_key_payload(did_id: bytes, public_key: bytes) -> bytes:
-    return DID_REVOKE_KEY_PREFIX + _scale_vec_u8(did_id) + _scale_vec_u8(public_key)
+    return _build_payload(DID_REVOKE_KEY_PREFIX, did_id, public_key)
 
 
 def build_set_metadata_payload(did_id: bytes, key: bytes, value: bytes) -> bytes:
-    return DID_SET_METADATA_PREFIX + _scale_vec_u8(did_id) + _scale_vec_u8(key) + _scale_vec_u8(value)
+    return _build_payload(DID_SET_METADATA_PREFIX, did_id, key, value)
 
 
 def build_remove_metadata_payload(did_id: bytes, key: bytes) -> bytes:
-    return DID_REMOVE_METADATA_PREFIX + _scale_vec_u8(did_id) + _scale_vec_u8(key)
+    return _build_payload(DID_REMOVE_METADATA_PREFIX, did_id, key)
 
 
 def build_rotate_key_payload(
@@ -132,21 +122,21 @@ def build_rotate_key_payload(
     new_public_key: bytes,
     roles: list[str],
 ) -> bytes:
-    return (
-        DID_ROTATE_KEY_PREFIX
-        + _scale_vec_u8(did_id)
-        + _scale_vec_u8(old_public_key)
-        + _scale_vec_u8(new_public_key)
-        + _scale_roles(roles)
+    return _build_payload(
+        DID_ROTATE_KEY_PREFIX,
+        did_id,
+        old_public_key,
+        new_public_key,
+        roles=roles,
     )
 
 
 def build_update_roles_payload(did_id: bytes, public_key: bytes, roles: list[str]) -> bytes:
-    return DID_UPDATE_ROLES_PREFIX + _scale_vec_u8(did_id) + _scale_vec_u8(public_key) + _scale_roles(roles)
+    return _build_payload(DID_UPDATE_ROLES_PREFIX, did_id, public_key, roles=roles)
 
 
 def build_deactivate_did_payload(did_id: bytes) -> bytes:
-    return DID_DEACTIVATE_PREFIX + _scale_vec_u8(did_id)
+    return _build_payload(DID_DEACTIVATE_PREFIX, did_id)
 
 
 def build_schema_json() -> bytes:
@@ -155,7 +145,18 @@ def build_schema_json() -> bytes:
     return json.dumps(schema_obj, separators=(",", ":")).encode("utf-8")
 
 
-def load_account(json_path: str) -> Keypair:
+def _print_did_document(did_doc: dict) -> None:
+    if orjson is None:
+        print(json.dumps(did_doc, indent=2))
+        return
+    sys.stdout.flush()
+    sys.stdout.buffer.write(orjson.dumps(did_doc, option=orjson.OPT_INDENT_2) + b"\n")
+    sys.stdout.buffer.flush()
+
+
+def load_account(json_path: str) -> "Keypair":
+    from substrateinterface import Keypair
+
     with open(json_path, "r", encoding="utf-8") as f:
         account_json = json.load(f)
 
@@ -183,8 +184,27 @@ def main() -> None:
     if not account_json_path:
         raise SystemExit("Provide --account-json or set ACCOUNT_JSON in .env")
 
+    from app.substrate_client import (
+        compose_add_key,
+        compose_add_service,
+        compose_deactivate_did,
+        compose_deprecate_schema,
+        compose_register_schema,
+        compose_remove_metadata,
+        compose_remove_service,
+        compose_revoke_key,
+        compose_rotate_key,
+        compose_set_metadata,
+        compose_update_roles,
+        create_did,
+        create_substrate,
+        get_free_balance,
+        submit_batch,
+    )
+
     print(f"{LOG_STEP} Step: connect substrate")
     substrate = create_substrate(RPC_URL)
+    genesis_hash = substrate.get_block_hash(0)
     print(f"{LOG_STEP} Step: load account")
     account = load_account(account_json_path)
     print(f"{LOG_OK} Loaded account: {account.ss58_address}")
@@ -196,17 +216,18 @@ def main() -> None:
     stored = load_did_keys()
     if stored:
         did, public_key, private_key = stored
+        signer = DidSigner(private_key)
         print(f"{LOG_DID} DID: {did}")
     else:
         public_key, private_key = generate_keypair()
+        signer = DidSigner(private_key)
         print(f"{LOG_OK} ML-DSA-44 public key: {public_key.hex()}")
-        genesis_hash = substrate.get_block_hash(0)
         did_id = derive_did_id(genesis_hash, public_key)
         did = f"did:qsb:{did_id}"
         print(f"{LOG_DID} DID: {did}")
 
         payload = build_create_did_payload(public_key)
-        did_signature = sign(private_key, payload)
+        did_signature = signer.sign(payload)
         receipt = create_did(substrate, account, public_key, did_signature)
         log_receipt(receipt)
         is_success = getattr(receipt, "is_success", None)
@@ -216,190 +237,203 @@ def main() -> None:
             raise SystemExit("DID create failed; not saving DID keys")
         store_did_keys(did, public_key, private_key)
 
-    if "genesis_hash" not in locals():
-        genesis_hash = substrate.get_block_hash(0)
     print(f"{LOG_STEP} Step: resolve DID document")
     did_doc = resolve_did(substrate, did)
     if did_doc:
         print(f"{LOG_DID} DID document:")
-        print(json.dumps(did_doc, indent=2))
+        _print_did_document(did_doc)
     else:
         print(f"{LOG_WARN} DID not found or invalid response")
 
     did_bytes = did.encode("utf-8")
-
-    print(f"{LOG_STEP} Step: add DID key (assertion method)")
     secondary_public_key, _ = generate_keypair()
+    rotated_public_key, _ = generate_keypair()
     add_key_roles = ["AssertionMethod"]
-    add_key_signature = sign(
-        private_key,
-        build_add_key_payload(did_bytes, secondary_public_key, add_key_roles),
-    )
-    receipt = add_key(
-        substrate,
-        account,
-        did_bytes,
-        secondary_public_key,
-        add_key_roles,
+    updated_roles = ["CapabilityInvocation"]
+    rotate_roles = ["CapabilityDelegation"]
+    metadata_key = b"profile"
+    metadata_value = b"https://example.com/profile"
+    service_id = DEFAULT_SERVICE_ID
+    service_type = DEFAULT_SERVICE_TYPE
+    service_endpoint = DEFAULT_SERVICE_ENDPOINT
+
+    print(f"{LOG_STEP} Step: sign DID key, metadata and service payloads")
+    (
         add_key_signature,
+        update_roles_signature,
+        rotate_signature,
+        set_metadata_signature,
+        add_service_signature,
+    ) = signer.sign_many(
+        [
+            build_add_key_payload(did_bytes, secondary_public_key, add_key_roles),
+            build_update_roles_payload(did_bytes, secondary_public_key, updated_roles),
+            build_rotate_key_payload(
+                did_bytes,
+                secondary_public_key,
+                rotated_public_key,
+                rotate_roles,
+            ),
+            build_set_metadata_payload(did_bytes, metadata_key, metadata_value),
+            build_add_service_payload(did_bytes, service_id, service_type, service_endpoint),
+        ]
     )
-    log_receipt(receipt)
+    calls = []
 
-    print(f"{LOG_STEP} Step: update DID key roles")
-    updated_roles = ["CapabilityInvocation"]
-    update_roles_signature = sign(
-        private_key,
-        build_update_roles_payload(did_bytes, secondary_public_key, updated_roles),
+    print(f"{LOG_STEP} Step: add DID key (assertion method)")
+    calls.append(
+        compose_add_key(
+            substrate,
+            did_bytes,
+            secondary_public_key,
+            add_key_roles,
+            add_key_signature,
+        )
     )
-    receipt = update_roles(
-        substrate,
-        account,
-        did_bytes,
-        secondary_public_key,
-        updated_roles,
-        update_roles_signature,
+
+    print(f"{LOG_STEP} Step: update DID key roles")
+    calls.append(
+        compose_update_roles(
+            substrate,
+            did_bytes,
+            secondary_public_key,
+            updated_roles,
+            update_roles_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: rotate DID key")
-    rotated_public_key, _ = generate_keypair()
-    rotate_roles = ["CapabilityDelegation"]
-    rotate_signature = sign(
-        private_key,
-        build_rotate_key_payload(
+    calls.append(
+        compose_rotate_key(
+            substrate,
             did_bytes,
             secondary_public_key,
             rotated_public_key,
             rotate_roles,
-        ),
-    )
-    receipt = rotate_key(
-        substrate,
-        account,
-        did_bytes,
-        secondary_public_key,
-        rotated_public_key,
-        rotate_roles,
-        rotate_signature,
+            rotate_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: set DID metadata")
-    metadata_key = b"profile"
-    metadata_value = b"https://example.com/profile"
-    set_metadata_signature = sign(
-        private_key,
-        build_set_metadata_payload(did_bytes, metadata_key, metadata_value),
-    )
-    receipt = set_metadata(
-        substrate,
-        account,
-        did_bytes,
-        metadata_key,
-        metadata_value,
-        set_metadata_signature,
+    calls.append(
+        compose_set_metadata(
+            substrate,
+            did_bytes,
+            metadata_key,
+            metadata_value,
+            set_metadata_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: add DID service")
-    service_id = DEFAULT_SERVICE_ID
-    service_type = DEFAULT_SERVICE_TYPE
-    service_endpoint = DEFAULT_SERVICE_ENDPOINT
-    add_service_signature = sign(
-        private_key,
-        build_add_service_payload(did_bytes, service_id, service_type, service_endpoint),
-    )
-    receipt = add_service(
-        substrate,
-        account,
-        did_bytes,
-        service_id,
-        service_type,
-        service_endpoint,
-        add_service_signature,
+    calls.append(
+        compose_add_service(
+            substrate,
+            did_bytes,
+            service_id,
+            service_type,
+            service_endpoint,
+            add_service_signature,
+        )
     )
+
+    print(f"{LOG_STEP} Step: submit batch ({len(calls)} calls)")
+    receipt = submit_batch(substrate, account, calls)
     log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: resolve DID document (after add service)")
     did_doc = resolve_did(substrate, did)
     if did_doc:
         print(f"{LOG_DID} DID document:")
-        print(json.dumps(did_doc, indent=2))
+        _print_did_document(did_doc)
     else:
         print(f"{LOG_WARN} DID not found or invalid response")
 
+    schema_json = build_schema_json()
+    schema_uri = DEFAULT_SCHEMA_URI
+
+    print(f"{LOG_STEP} Step: sign DID cleanup and schema payloads")
+    (
+        remove_service_signature,
+        remove_metadata_signature,
+        revoke_key_signature,
+        schema_signature,
+        deactivate_signature,
+    ) = signer.sign_many(
+        [
+            build_remove_service_payload(did_bytes, service_id),
+            build_remove_metadata_payload(did_bytes, metadata_key),
+            build_revoke_key_payload(did_bytes, rotated_public_key),
+            SCHEMA_PREFIX + schema_json,
+            build_deactivate_did_payload(did_bytes),
+        ]
+    )
+    calls = []
+
     print(f"{LOG_STEP} Step: remove DID service")
-    receipt = remove_service(
-        substrate,
-        account,
-        did_bytes,
-        service_id,
-        sign(private_key, build_remove_service_payload(did_bytes, service_id)),
+    calls.append(
+        compose_remove_service(
+            substrate,
+            did_bytes,
+            service_id,
+            remove_service_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: remove DID metadata")
-    remove_metadata_signature = sign(
-        private_key,
-        build_remove_metadata_payload(did_bytes, metadata_key),
-    )
-    receipt = remove_metadata(
-        substrate,
-        account,
-        did_bytes,
-        metadata_key,
-        remove_metadata_signature,
+    calls.append(
+        compose_remove_metadata(
+            substrate,
+            did_bytes,
+            metadata_key,
+            remove_metadata_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: revoke rotated DID key")
-    revoke_key_signature = sign(
-        private_key,
-        build_revoke_key_payload(did_bytes, rotated_public_key),
-    )
-    receipt = revoke_key(
-        substrate,
-        account,
-        did_bytes,
-        rotated_public_key,
-        revoke_key_signature,
+    calls.append(
+        compose_revoke_key(
+            substrate,
+            did_bytes,
+            rotated_public_key,
+            revoke_key_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: register schema")
-    schema_json = build_schema_json()
-    schema_uri = DEFAULT_SCHEMA_URI
     schema_id = derive_schema_id(genesis_hash, schema_json)
     print(f"{LOG_SCHEMA} Schema ID: {schema_id}")
-    schema_signature = sign(private_key, SCHEMA_PREFIX + schema_json)
-    receipt = register_schema(
-        substrate,
-        account,
-        schema_json,
-        schema_uri,
-        did.encode("utf-8"),
-        schema_signature,
+    calls.append(
+        compose_register_schema(
+            substrate,
+            schema_json,
+            schema_uri,
+            did.encode("utf-8"),
+            schema_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: deprecate schema")
-    receipt = deprecate_schema(
-        substrate,
-        account,
-        schema_id.encode("utf-8"),
-        did.encode("utf-8"),
-        schema_signature,
+    calls.append(
+        compose_deprecate_schema(
+            substrate,
+            schema_id.encode("utf-8"),
+            did.encode("utf-8"),
+            schema_signature,
+        )
     )
-    log_receipt(receipt)
 
     print(f"{LOG_STEP} Step: deactivate DID")
-    deactivate_signature = sign(private_key, build_deactivate_did_payload(did_bytes))
-    receipt = deactivate_did(
-        substrate,
-        account,
-        did_bytes,
-        deactivate_signature,
+    calls.append(
+        compose_deactivate_did(
+            substrate,
+            did_bytes,
+            deactivate_signature,
+        )
     )
+
+    print(f"{LOG_STEP} Step: submit batch ({len(calls)} calls)")
+    receipt = submit_batch(substrate, account, calls)
     log_receipt(receipt)
 
     print(f"{LOG_OK} Done.")
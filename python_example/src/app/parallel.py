@@ -0,0 +1,10 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parallel_map(fn, items: list) -> list:
+    max_workers = min(len(items), os.cpu_count() or 1)
+    if max_workers < 2:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(fn, items))
@@ -0,0 +1,5 @@
+def scale_compact_u32(value: int) -> bytes:
+    if value >= 1 << 30:
+        raise ValueError("Compact SCALE length too large")
+    mode = 0 if value < 1 << 6 else 1 if value < 1 << 14 else 2
+    return ((value << 2) | mode).to_bytes(1 << mode, "little")
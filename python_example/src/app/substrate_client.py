@@ -1,148 +1,987 @@
+import atexit
+import functools
+import hashlib
+import json
+import os
 import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from enum import Enum
+from pathlib import Path
+from urllib.parse import urlsplit
 
-from substrateinterface import SubstrateInterface
+from scalecodec.base import ScaleBytes
+from scalecodec.types import U8, Enum as ScaleEnum, Vec
+from substrateinterface import ExtrinsicReceipt, KeypairType, SubstrateInterface
+from substrateinterface.exceptions import SubstrateRequestException
+from substrateinterface.transport import WebsocketTransport
+from substrateinterface.transport.base import list_remove_iter
+from websocket import WebSocketConnectionClosedException
 
+from app.scale import scale_compact_u32
 
-def create_substrate(url: str) -> SubstrateInterface:
-    return SubstrateInterface(
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = [
+    "OrjsonCodec",
+    "OrjsonWebsocketTransport",
+    "SubmissionTimeout",
+    "PartialSubmission",
+    "WaitLevel",
+    "MetadataFileCache",
+    "CachingSubstrateInterface",
+    "create_substrate",
+    "close_all",
+    "get_free_balance",
+    "get_free_balances",
+    "NonceManager",
+    "nonce_manager",
+    "submit_extrinsic_hash_only",
+    "submit_with_timeout",
+    "await_inclusion",
+    "await_finalized",
+    "submit_many",
+    "submit_batch",
+    "compose_create_did",
+    "create_did",
+    "compose_add_key",
+    "add_key",
+    "compose_revoke_key",
+    "revoke_key",
+    "compose_deactivate_did",
+    "deactivate_did",
+    "compose_register_schema",
+    "register_schema",
+    "compose_deprecate_schema",
+    "deprecate_schema",
+    "compose_add_service",
+    "add_service",
+    "compose_remove_service",
+    "remove_service",
+    "compose_set_metadata",
+    "set_metadata",
+    "compose_remove_metadata",
+    "remove_metadata",
+    "compose_rotate_key",
+    "rotate_key",
+    "compose_update_roles",
+    "update_roles",
+    "WORKFLOW_COMPOSERS",
+    "run_workflow",
+]
+
+METADATA_CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "qsb"
+SUBMIT_TIMEOUT = 60.0
+SUBMIT_ABORT_GRACE = 1.0
+RECEIPT_TIMEOUT = 60.0
+RECEIPT_POLL_INTERVAL = 1.0
+INCLUSION_LOOKBACK_BLOCKS = 4
+RUNTIME_CHECK_INTERVAL = 60.0
+BALANCE_CACHE_TTL = 6.0
+BALANCE_QUERY_CHUNK_SIZE = 1000
+IMMORTAL_ERA = "00"
+MORTAL_ERA_PERIOD = 64
+NONCE_ERROR_MARKERS = ("1014", "Priority is too low", "Transaction is outdated", "InvalidNonce", "Stale")
+BYTES_LIKE = (bytes, bytearray, memoryview)
+CONNECTION_ERRORS = (WebSocketConnectionClosedException, BrokenPipeError, ConnectionResetError)
+
+
+@functools.lru_cache(maxsize=4)
+def _ssl_context(ca_bundle: str | None, insecure: bool) -> ssl.SSLContext:
+    context = ssl.create_default_context(cafile=ca_bundle)
+    context.set_alpn_protocols(["http/1.1"])
+    if insecure:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def _has_float(value) -> bool:
+    if type(value) is float:
+        return True
+    if type(value) is dict:
+        return any(_has_float(item) for item in value.values())
+    if type(value) is list:
+        return any(_has_float(item) for item in value)
+    return False
+
+
+class OrjsonCodec:
+    @staticmethod
+    def dumps(payload) -> bytes | str:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            return json.dumps(payload)
+
+    @staticmethod
+    def loads(message):
+        decoded = orjson.loads(message)
+        if _has_float(decoded):
+            return json.loads(message)
+        return decoded
+
+
+class OrjsonWebsocketTransport(WebsocketTransport):
+    def __init__(self, *args, **kwargs):
+        self._message_queue = []
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def adopt(cls, transport: WebsocketTransport) -> "OrjsonWebsocketTransport":
+        return cls(
+            url=transport.url,
+            websocket=transport.websocket,
+            ws_options=transport.ws_options,
+            auto_reconnect=transport.auto_reconnect,
+            debug_fn=transport._debug_fn,
+            on_connect=transport.on_connect,
+        )
+
+    def rpc_request(self, payload, result_handler=None):
+        request_id = payload["id"]
+        try:
+            self.websocket.send(OrjsonCodec.dumps(payload))
+        except WebSocketConnectionClosedException:
+            if self.auto_reconnect and self.url:
+                self.debug_message("Connection Closed; Trying to reconnecting...")
+                self.connect()
+                return self.rpc_request(payload=payload, result_handler=result_handler)
+            raise
+
+        update_nr = 0
+        json_body = None
+        subscription_id = None
+        while json_body is None:
+            for message, remove_message in list_remove_iter(self._message_queue):
+                if "id" in message and message["id"] == request_id:
+                    remove_message()
+                    if "error" in message:
+                        raise SubstrateRequestException(message["error"])
+                    if callable(result_handler):
+                        subscription_id = message["result"]
+                        self.debug_message(f"Websocket subscription [{subscription_id}] created")
+                    else:
+                        json_body = message
+
+            for message, remove_message in list_remove_iter(self._message_queue):
+                if "params" in message and message["params"]["subscription"] == subscription_id:
+                    remove_message()
+                    self.debug_message(f"Websocket result [{subscription_id} #{update_nr}]: {message}")
+                    callback_result = result_handler(message, update_nr, subscription_id)
+                    if callback_result is not None:
+                        json_body = callback_result
+                    update_nr += 1
+
+            if json_body is None:
+                self._message_queue.append(OrjsonCodec.loads(self.websocket.recv()))
+
+        return json_body
+
+_POOL: dict[str, SubstrateInterface] = {}
+_POOL_LOCK = threading.Lock()
+_SUBMIT_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="substrate-submit")
+_BALANCE_CACHE: dict[tuple[SubstrateInterface, str], tuple[float, int]] = {}
+
+
+class SubmissionTimeout(TimeoutError):
+    pass
+
+
+class PartialSubmission(SubstrateRequestException):
+    def __init__(self, message: str, receipts: list):
+        super().__init__(message)
+        self.receipts = receipts
+
+
+class WaitLevel(Enum):
+    NONE = "none"
+    BROADCAST = "broadcast"
+    IN_BLOCK = "in_block"
+    FINALIZED = "finalized"
+
+
+class MetadataFileCache:
+    def __init__(self, substrate: SubstrateInterface, directory: Path):
+        self._substrate = substrate
+        self._directory = directory
+
+    def _path(self, key: str) -> Path:
+        genesis_hash = self._substrate.get_block_hash(0)
+        return self._directory / genesis_hash.lower() / f"{key.lower()}.bin"
+
+    def get(self, key: str):
+        try:
+            data = self._path(key).read_bytes()
+        except OSError:
+            return None
+        metadata = self._substrate.runtime_config.create_scale_object(
+            "MetadataVersioned",
+            data=ScaleBytes(data),
+        )
+        try:
+            metadata.decode()
+        except Exception:
+            return None
+        return metadata
+
+    def set(self, key: str, metadata) -> None:
+        path = self._path(key)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(bytes(metadata.data.data))
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+class CachingSubstrateInterface(SubstrateInterface):
+    def __init__(self, *args, **kwargs):
+        self._genesis_hash = None
+        self._runtime_checked_at = None
+        self.checked_head_hash = None
+        super().__init__(*args, **kwargs)
+
+    def get_block_hash(self, block_id: int = None) -> str:
+        if block_id != 0:
+            return super().get_block_hash(block_id)
+        if self._genesis_hash is None:
+            self._genesis_hash = super().get_block_hash(0)
+        return self._genesis_hash
+
+    def init_runtime(self, block_hash=None, block_id=None):
+        at_head = block_hash is None and block_id is None
+        if (
+            at_head
+            and self.metadata is not None
+            and self._runtime_checked_at is not None
+            and time.monotonic() - self._runtime_checked_at < RUNTIME_CHECK_INTERVAL
+        ):
+            return
+        super().init_runtime(block_hash=block_hash, block_id=block_id)
+        self._runtime_checked_at = time.monotonic() if at_head else None
+        if at_head:
+            self.checked_head_hash = self.block_hash
+
+
+def _make_substrate(url: str) -> SubstrateInterface:
+    context = _ssl_context(os.getenv("SSL_CA_BUNDLE") or None, os.getenv("SSL_INSECURE") == "1")
+    substrate = CachingSubstrateInterface(
         url=url,
-        ws_options={"sslopt": {"cert_reqs": ssl.CERT_NONE}},
+        ws_options={"sslopt": {"context": context}},
     )
+    cache_dir = METADATA_CACHE_DIR / urlsplit(url).netloc.replace(":", "_")
+    substrate.cache_region = MetadataFileCache(substrate, cache_dir)
+    if orjson is not None and type(substrate.transport) is WebsocketTransport:
+        substrate.transport = OrjsonWebsocketTransport.adopt(substrate.transport)
+    return substrate
+
+
+def create_substrate(url: str) -> SubstrateInterface:
+    with _POOL_LOCK:
+        substrate = _POOL.get(url)
+        if substrate is None:
+            substrate = _POOL[url] = _make_substrate(url)
+        return substrate
+
+
+@atexit.register
+def close_all() -> None:
+    with _POOL_LOCK:
+        for substrate in _POOL.values():
+            substrate.close()
+        _POOL.clear()
+    _BALANCE_CACHE.clear()
+
+
+def _with_retry(func):
+    @functools.wraps(func)
+    def wrapper(substrate: SubstrateInterface, *args, **kwargs):
+        try:
+            return func(substrate, *args, **kwargs)
+        except CONNECTION_ERRORS:
+            substrate.connect_websocket()
+            return func(substrate, *args, **kwargs)
+
+    return wrapper
+
+
+def _is_bytes_type(runtime_config, decoder_class) -> bool:
+    return issubclass(decoder_class, Vec) and runtime_config.get_decoder_class(decoder_class.sub_type) is U8
+
 
+def _unit_variant_indexes(runtime_config, decoder_class) -> dict[str, bytes] | None:
+    if not issubclass(decoder_class, Vec) or decoder_class.sub_type is None:
+        return None
+    element_class = runtime_config.get_decoder_class(decoder_class.sub_type)
+    if element_class is None or not issubclass(element_class, ScaleEnum) or not element_class.type_mapping:
+        return None
+    return {
+        variant: bytes([index])
+        for index, (variant, variant_type) in enumerate(element_class.type_mapping)
+        if variant is not None and variant_type == "Null"
+    }
 
-def get_free_balance(substrate: SubstrateInterface, address: str) -> int:
+
+def _encode_variant_list(variant_indexes: dict[str, bytes], values: list) -> bytes | None:
+    try:
+        encoded = b"".join([variant_indexes[value] for value in values])
+    except (KeyError, TypeError):
+        return None
+    return scale_compact_u32(len(values)) + encoded
+
+
+@functools.lru_cache(maxsize=8)
+def _call_table(substrate: SubstrateInterface, runtime_version) -> dict:
+    runtime_config = substrate.runtime_config
+    table = {}
+    for pallet in substrate.metadata.pallets:
+        calls = pallet["calls"].value_object
+        if not calls:
+            continue
+        call_type = runtime_config.create_scale_object(calls.get_type_string())
+        for function in call_type.scale_info_type["def"][1].value_object["variants"]:
+            fields = []
+            for field in function["fields"]:
+                decoder_class = runtime_config.get_decoder_class(field.get_type_string())
+                is_bytes = _is_bytes_type(runtime_config, decoder_class)
+                variant_indexes = None if is_bytes else _unit_variant_indexes(runtime_config, decoder_class)
+                fields.append((field.value["name"], decoder_class, is_bytes, variant_indexes))
+            table[(pallet.value["name"], function.value["name"])] = (
+                bytes([pallet.value["index"], function.value["index"]]),
+                pallet,
+                function,
+                tuple(fields),
+            )
+    return table
+
+
+def _resolve_call(substrate: SubstrateInterface, call_module: str, call_function: str):
+    resolved = _call_table(substrate, substrate.runtime_version).get((call_module, call_function))
+    if resolved is None:
+        raise ValueError(f"Call function '{call_module}.{call_function}' not found")
+    return resolved
+
+
+def _encode_call_fast(substrate: SubstrateInterface, resolved, call_params: dict):
+    call_index, pallet, function, fields = resolved
+    call_params = dict(call_params)
+    args = {}
+    parts = [call_index]
+    for name, decoder_class, is_bytes, variant_indexes in fields:
+        if name not in call_params:
+            raise ValueError(f"Parameter '{name}' not specified")
+        value = call_params[name]
+        if is_bytes and isinstance(value, BYTES_LIKE):
+            value = call_params[name] = bytes(value)
+            parts.append(scale_compact_u32(len(value)))
+            parts.append(value)
+            args[name] = value
+            continue
+        if variant_indexes is not None and type(value) is list:
+            encoded = _encode_variant_list(variant_indexes, value)
+            if encoded is not None:
+                parts.append(encoded)
+                args[name] = value
+                continue
+        arg = decoder_class(metadata=substrate.metadata)
+        parts.append(arg.encode(value).data)
+        args[name] = arg
+    data = bytearray().join(parts)
+    call = substrate.runtime_config.create_scale_object("Call", metadata=substrate.metadata)
+    call.data = ScaleBytes(data)
+    call.call_index = call_index.hex()
+    call.call_module = pallet
+    call.call_function = function
+    call.call_args = function["fields"]
+    call.call_hash = hashlib.blake2b(data, digest_size=32).digest()
+    call.value_serialized = {
+        "call_module": pallet.value["name"],
+        "call_function": function.value["name"],
+        "call_args": call_params,
+    }
+    call.value_object = {
+        "call_module": pallet,
+        "call_function": function,
+        "call_args": args,
+    }
+    return call
+
+
+@_with_retry
+def _compose(substrate: SubstrateInterface, call_module: str, call_function: str, call_params: dict):
+    if substrate.metadata is None:
+        substrate.init_runtime()
+    resolved = _resolve_call(substrate, call_module, call_function)
+    return _encode_call_fast(substrate, resolved, call_params)
+
+
+@_with_retry
+def _query_free_balance(substrate: SubstrateInterface, address: str) -> int:
     account_info = substrate.query("System", "Account", [address])
     return account_info.value["data"]["free"]
 
 
-def create_did(substrate: SubstrateInterface, account, public_key: bytes, did_signature: bytes):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="create_did",
-        call_params={
+def get_free_balance(
+    substrate: SubstrateInterface,
+    address: str,
+    max_age: float = BALANCE_CACHE_TTL,
+) -> int:
+    key = (substrate, address)
+    cached = _BALANCE_CACHE.get(key)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < max_age:
+        return cached[1]
+    free = _query_free_balance(substrate, address)
+    _BALANCE_CACHE[key] = (now, free)
+    return free
+
+
+@_with_retry
+def _query_free_balances(substrate: SubstrateInterface, addresses: list[str]) -> dict[str, int]:
+    storage_keys = [substrate.create_storage_key("System", "Account", [address]) for address in addresses]
+    address_by_key = {key.to_hex(): address for key, address in zip(storage_keys, addresses)}
+    return {
+        address_by_key[key.to_hex()]: account_info.value["data"]["free"]
+        for key, account_info in substrate.query_multi(storage_keys)
+    }
+
+
+def get_free_balances(
+    substrate: SubstrateInterface,
+    addresses: list[str],
+    max_age: float = BALANCE_CACHE_TTL,
+) -> dict[str, int]:
+    now = time.monotonic()
+    balances = {}
+    missing = []
+    for address in dict.fromkeys(addresses):
+        cached = _BALANCE_CACHE.get((substrate, address))
+        if cached is not None and now - cached[0] < max_age:
+            balances[address] = cached[1]
+        else:
+            missing.append(address)
+    for start in range(0, len(missing), BALANCE_QUERY_CHUNK_SIZE):
+        chunk = missing[start:start + BALANCE_QUERY_CHUNK_SIZE]
+        for address, free in _query_free_balances(substrate, chunk).items():
+            balances[address] = free
+            _BALANCE_CACHE[(substrate, address)] = (now, free)
+    return balances
+
+
+def _forget_balance(substrate: SubstrateInterface, address: str) -> None:
+    _BALANCE_CACHE.pop((substrate, address), None)
+
+
+class NonceManager:
+    def __init__(self, substrate: SubstrateInterface, address: str):
+        self._substrate = substrate
+        self._address = address
+        self._lock = threading.Lock()
+        self._next_nonce = None
+
+    def next(self) -> int:
+        with self._lock:
+            if self._next_nonce is None:
+                self._next_nonce = self._substrate.get_account_nonce(self._address)
+            nonce = self._next_nonce
+            self._next_nonce += 1
+            return nonce
+
+    def resync(self) -> None:
+        with self._lock:
+            self._next_nonce = self._substrate.get_account_nonce(self._address)
+
+
+@functools.lru_cache(maxsize=64)
+def nonce_manager(substrate: SubstrateInterface, address: str) -> NonceManager:
+    return NonceManager(substrate, address)
+
+
+def _is_nonce_error(exc: Exception) -> bool:
+    message = str(exc)
+    return any(marker in message for marker in NONCE_ERROR_MARKERS)
+
+
+def _era(substrate: SubstrateInterface, immortal: bool):
+    if immortal:
+        return IMMORTAL_ERA
+    current = substrate.get_block_number(substrate.get_chain_finalised_head())
+    return {"period": MORTAL_ERA_PERIOD, "current": current}
+
+
+@_with_retry
+def _sign(substrate: SubstrateInterface, account, call, nonce: int | None = None, immortal: bool = True):
+    return substrate.create_signed_extrinsic(
+        call=call,
+        keypair=account,
+        era=_era(substrate, immortal),
+        nonce=nonce,
+        tip=0,
+    )
+
+
+@_with_retry
+def _sign_all(
+    substrate: SubstrateInterface,
+    account,
+    calls: list,
+    nonces: list[int],
+    immortal: bool = True,
+):
+    if account.crypto_type == KeypairType.ECDSA:
+        return [_sign(substrate, account, call, nonce, immortal) for call, nonce in zip(calls, nonces)]
+    substrate.init_runtime()
+    era = _era(substrate, immortal)
+    payloads = [
+        substrate.generate_signature_payload(call=call, era=era, nonce=nonce, tip=0)
+        for call, nonce in zip(calls, nonces)
+    ]
+    signatures = [account.sign(payload) for payload in payloads]
+    return [
+        substrate.create_signed_extrinsic(
+            call=call,
+            keypair=account,
+            era=era,
+            nonce=nonce,
+            tip=0,
+            signature=signature,
+        )
+        for call, nonce, signature in zip(calls, nonces, signatures)
+    ]
+
+
+def _submit(
+    substrate: SubstrateInterface,
+    account,
+    call,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    _forget_balance(substrate, account.ss58_address)
+    nonces = nonce_manager(substrate, account.ss58_address)
+    extrinsic = _sign(substrate, account, call, nonces.next(), immortal)
+    try:
+        return submit_with_timeout(substrate, extrinsic, wait)
+    except SubstrateRequestException as exc:
+        nonces.resync()
+        if not _is_nonce_error(exc):
+            raise
+    except SubmissionTimeout:
+        nonces.resync()
+        raise
+    extrinsic = _sign(substrate, account, call, nonces.next(), immortal)
+    return submit_with_timeout(substrate, extrinsic, wait)
+
+
+def submit_extrinsic_hash_only(substrate: SubstrateInterface, extrinsic) -> str:
+    response = substrate.rpc_request("author_submitExtrinsic", [str(extrinsic.data)])
+    if "error" in response:
+        raise SubstrateRequestException(response["error"])
+    return response["result"]
+
+
+def _scan_start(substrate: SubstrateInterface, from_block_hashes: set) -> int:
+    if None in from_block_hashes or not from_block_hashes:
+        return max(substrate.get_block_number(None) - INCLUSION_LOOKBACK_BLOCKS, 0)
+    return min(substrate.get_block_number(block_hash) for block_hash in from_block_hashes)
+
+
+def submit_with_timeout(
+    substrate: SubstrateInterface,
+    extrinsic,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    timeout: float = SUBMIT_TIMEOUT,
+):
+    if wait is WaitLevel.NONE:
+        return submit_extrinsic_hash_only(substrate, extrinsic)
+    from_block_hash = getattr(substrate, "checked_head_hash", None)
+    if wait is WaitLevel.BROADCAST:
+        receipt = substrate.submit_extrinsic(extrinsic)
+        receipt.from_block_hash = from_block_hash
+        return receipt
+    extrinsic_hash = f"0x{extrinsic.extrinsic_hash.hex()}"
+    deadline = time.monotonic() + timeout
+    future = _SUBMIT_EXECUTOR.submit(
+        substrate.submit_extrinsic,
+        extrinsic,
+        wait_for_inclusion=wait is WaitLevel.IN_BLOCK,
+        wait_for_finalization=wait is WaitLevel.FINALIZED,
+    )
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        substrate.websocket.abort()
+        futures_wait([future], timeout=SUBMIT_ABORT_GRACE)
+        if not future.done():
+            raise SubmissionTimeout(f"Extrinsic {extrinsic_hash} submission could not be interrupted")
+    except CONNECTION_ERRORS:
+        pass
+    substrate.websocket.close()
+    substrate.connect_websocket()
+    start_block = _scan_start(substrate, {from_block_hash})
+    head = substrate.get_block_number(None)
+    found = _find_extrinsics(substrate, {extrinsic_hash}, range(start_block, head + 1))
+    receipt = found.get(extrinsic_hash)
+    if receipt is None:
+        pending = substrate.rpc_request("author_pendingExtrinsics", []).get("result") or []
+        if str(extrinsic.data) not in pending:
+            raise SubmissionTimeout(f"Extrinsic {extrinsic_hash} not found in new blocks or the tx pool")
+        receipt = ExtrinsicReceipt(substrate=substrate, extrinsic_hash=extrinsic_hash)
+    remaining = max(deadline - time.monotonic(), 0.0)
+    try:
+        if wait is WaitLevel.FINALIZED:
+            return await_finalized(substrate, receipt, remaining, head + 1)
+        return await_inclusion(substrate, receipt, remaining, head + 1)
+    except TimeoutError as exc:
+        raise SubmissionTimeout(str(exc)) from exc
+
+
+def _find_extrinsics(substrate: SubstrateInterface, extrinsic_hashes: set, block_numbers) -> dict:
+    found = {}
+    for block_number in block_numbers:
+        block = substrate.get_block(block_number=block_number)
+        for index, extrinsic in enumerate(block["extrinsics"]):
+            if not extrinsic.extrinsic_hash:
+                continue
+            extrinsic_hash = f"0x{extrinsic.extrinsic_hash.hex()}"
+            if extrinsic_hash in extrinsic_hashes:
+                found[extrinsic_hash] = ExtrinsicReceipt(
+                    substrate=substrate,
+                    extrinsic_hash=extrinsic_hash,
+                    block_hash=block["header"]["hash"],
+                    block_number=block_number,
+                    extrinsic_idx=index,
+                )
+        if len(found) == len(extrinsic_hashes):
+            break
+    return found
+
+
+def _await_included(
+    substrate: SubstrateInterface,
+    receipts: list,
+    timeout: float,
+    from_block: int | None = None,
+) -> list:
+    results = list(receipts)
+    pending = {
+        receipt.extrinsic_hash: index
+        for index, receipt in enumerate(receipts)
+        if not receipt.block_hash
+    }
+    if not pending:
+        return results
+    deadline = time.monotonic() + timeout
+    next_block = from_block
+    if next_block is None:
+        next_block = _scan_start(
+            substrate,
+            {getattr(receipts[index], "from_block_hash", None) for index in pending.values()},
+        )
+    while True:
+        head = substrate.get_block_number(None)
+        found = _find_extrinsics(substrate, set(pending), range(next_block, head + 1))
+        for extrinsic_hash, receipt in found.items():
+            results[pending.pop(extrinsic_hash)] = receipt
+        if not pending:
+            return results
+        next_block = head + 1
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Extrinsic {', '.join(pending)} not included after {timeout}s")
+        time.sleep(RECEIPT_POLL_INTERVAL)
+
+
+def await_inclusion(
+    substrate: SubstrateInterface,
+    receipt,
+    timeout: float = RECEIPT_TIMEOUT,
+    from_block: int | None = None,
+):
+    return _await_included(substrate, [receipt], timeout, from_block)[0]
+
+
+def await_finalized(
+    substrate: SubstrateInterface,
+    receipt,
+    timeout: float = RECEIPT_TIMEOUT,
+    from_block: int | None = None,
+):
+    if receipt.finalized:
+        return receipt
+    deadline = time.monotonic() + timeout
+    receipt = await_inclusion(substrate, receipt, timeout, from_block)
+    block_number = receipt.block_number
+    if block_number is None:
+        block_number = substrate.get_block_number(receipt.block_hash)
+    while True:
+        finalized_number = substrate.get_block_number(substrate.get_chain_finalised_head())
+        if finalized_number >= block_number:
+            if substrate.get_block_hash(block_number) != receipt.block_hash:
+                raise RuntimeError(f"Block {receipt.block_hash} was not finalized")
+            receipt.finalized = True
+            return receipt
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Extrinsic {receipt.extrinsic_hash} not finalized after {timeout}s")
+        time.sleep(RECEIPT_POLL_INTERVAL)
+
+
+def submit_many(
+    substrate: SubstrateInterface,
+    account,
+    calls: list,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    nonces: NonceManager | None = None,
+    timeout: float = RECEIPT_TIMEOUT,
+    immortal: bool = True,
+) -> list:
+    _forget_balance(substrate, account.ss58_address)
+    if nonces is None:
+        nonces = nonce_manager(substrate, account.ss58_address)
+    extrinsics = _sign_all(substrate, account, calls, [nonces.next() for _ in calls], immortal)
+    from_block_hash = getattr(substrate, "checked_head_hash", None)
+    receipts = []
+    try:
+        for extrinsic in extrinsics:
+            if wait is WaitLevel.NONE:
+                receipts.append(submit_extrinsic_hash_only(substrate, extrinsic))
+                continue
+            receipt = substrate.submit_extrinsic(extrinsic)
+            receipt.from_block_hash = from_block_hash
+            receipts.append(receipt)
+    except SubstrateRequestException as exc:
+        nonces.resync()
+        raise PartialSubmission(
+            f"Submitted {len(receipts)} of {len(extrinsics)} extrinsics: {exc}",
+            receipts,
+        ) from exc
+    if wait is WaitLevel.NONE:
+        return receipts
+    if wait is WaitLevel.BROADCAST:
+        return receipts
+    receipts = _await_included(substrate, receipts, timeout)
+    if wait is WaitLevel.FINALIZED:
+        receipts = [await_finalized(substrate, receipt, timeout) for receipt in receipts]
+    return receipts
+
+
+def submit_batch(
+    substrate: SubstrateInterface,
+    account,
+    calls: list,
+    atomic: bool = True,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = _compose(
+        substrate,
+        "Utility",
+        "batch_all" if atomic else "batch",
+        {"calls": calls},
+    )
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_create_did(substrate: SubstrateInterface, public_key: bytes, did_signature: bytes):
+    return _compose(
+        substrate,
+        "Did",
+        "create_did",
+        {
             "public_key": public_key,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def add_key(
+def create_did(
     substrate: SubstrateInterface,
     account,
+    public_key: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_create_did(substrate, public_key, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_add_key(
+    substrate: SubstrateInterface,
     did_id: bytes,
     public_key: bytes,
     roles: list[str],
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="add_key",
-        call_params={
+    return _compose(
+        substrate,
+        "Did",
+        "add_key",
+        {
             "did_id": did_id,
             "public_key": public_key,
             "roles": roles,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def revoke_key(
+def add_key(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
     public_key: bytes,
+    roles: list[str],
     did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="revoke_key",
-        call_params={
+    call = compose_add_key(substrate, did_id, public_key, roles, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_revoke_key(
+    substrate: SubstrateInterface,
+    did_id: bytes,
+    public_key: bytes,
+    did_signature: bytes,
+):
+    return _compose(
+        substrate,
+        "Did",
+        "revoke_key",
+        {
             "did_id": did_id,
             "public_key": public_key,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def deactivate_did(
+def revoke_key(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
+    public_key: bytes,
     did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="deactivate_did",
-        call_params={
+    call = compose_revoke_key(substrate, did_id, public_key, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_deactivate_did(
+    substrate: SubstrateInterface,
+    did_id: bytes,
+    did_signature: bytes,
+):
+    return _compose(
+        substrate,
+        "Did",
+        "deactivate_did",
+        {
             "did_id": did_id,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def register_schema(
+def deactivate_did(
     substrate: SubstrateInterface,
     account,
+    did_id: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_deactivate_did(substrate, did_id, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_register_schema(
+    substrate: SubstrateInterface,
     schema_json: bytes,
     schema_uri: bytes,
     issuer_did: bytes,
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Schema",
-        call_function="register_schema",
-        call_params={
+    return _compose(
+        substrate,
+        "Schema",
+        "register_schema",
+        {
             "schema_json": schema_json,
             "schema_uri": schema_uri,
             "issuer_did": issuer_did,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def deprecate_schema(
+def register_schema(
     substrate: SubstrateInterface,
     account,
+    schema_json: bytes,
+    schema_uri: bytes,
+    issuer_did: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_register_schema(substrate, schema_json, schema_uri, issuer_did, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_deprecate_schema(
+    substrate: SubstrateInterface,
     schema_id: bytes,
     issuer_did: bytes,
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Schema",
-        call_function="deprecate_schema",
-        call_params={
+    return _compose(
+        substrate,
+        "Schema",
+        "deprecate_schema",
+        {
             "schema_id": schema_id,
             "issuer_did": issuer_did,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def add_service(
+def deprecate_schema(
     substrate: SubstrateInterface,
     account,
+    schema_id: bytes,
+    issuer_did: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_deprecate_schema(substrate, schema_id, issuer_did, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_add_service(
+    substrate: SubstrateInterface,
     did_id: bytes,
     service_id: bytes,
     service_type: bytes,
     endpoint: bytes,
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="add_service",
-        call_params={
+    return _compose(
+        substrate,
+        "Did",
+        "add_service",
+        {
             "did_id": did_id,
             "service": {
                 "id": service_id,
@@ -152,42 +991,66 @@ def add_service(
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def remove_service(
+def add_service(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
     service_id: bytes,
+    service_type: bytes,
+    endpoint: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_add_service(substrate, did_id, service_id, service_type, endpoint, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_remove_service(
+    substrate: SubstrateInterface,
+    did_id: bytes,
+    service_id: bytes,
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="remove_service",
-        call_params={
+    return _compose(
+        substrate,
+        "Did",
+        "remove_service",
+        {
             "did_id": did_id,
             "service_id": service_id,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def set_metadata(
+def remove_service(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
+    service_id: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_remove_service(substrate, did_id, service_id, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_set_metadata(
+    substrate: SubstrateInterface,
+    did_id: bytes,
     key: bytes,
     value: bytes,
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="set_metadata",
-        call_params={
+    return _compose(
+        substrate,
+        "Did",
+        "set_metadata",
+        {
             "did_id": did_id,
             "entry": {
                 "key": key,
@@ -196,43 +1059,66 @@ def set_metadata(
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def remove_metadata(
+def set_metadata(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
     key: bytes,
+    value: bytes,
     did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="remove_metadata",
-        call_params={
+    call = compose_set_metadata(substrate, did_id, key, value, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_remove_metadata(
+    substrate: SubstrateInterface,
+    did_id: bytes,
+    key: bytes,
+    did_signature: bytes,
+):
+    return _compose(
+        substrate,
+        "Did",
+        "remove_metadata",
+        {
             "did_id": did_id,
             "key": key,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def rotate_key(
+def remove_metadata(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
+    key: bytes,
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_remove_metadata(substrate, did_id, key, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_rotate_key(
+    substrate: SubstrateInterface,
+    did_id: bytes,
     old_public_key: bytes,
     new_public_key: bytes,
     roles: list[str],
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="rotate_key",
-        call_params={
+    return _compose(
+        substrate,
+        "Did",
+        "rotate_key",
+        {
             "did_id": did_id,
             "old_public_key": old_public_key,
             "new_public_key": new_public_key,
@@ -240,27 +1126,99 @@ def rotate_key(
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
 
 
-def update_roles(
+def rotate_key(
     substrate: SubstrateInterface,
     account,
     did_id: bytes,
+    old_public_key: bytes,
+    new_public_key: bytes,
+    roles: list[str],
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_rotate_key(substrate, did_id, old_public_key, new_public_key, roles, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+def compose_update_roles(
+    substrate: SubstrateInterface,
+    did_id: bytes,
     public_key: bytes,
     roles: list[str],
     did_signature: bytes,
 ):
-    call = substrate.compose_call(
-        call_module="Did",
-        call_function="update_roles",
-        call_params={
+    return _compose(
+        substrate,
+        "Did",
+        "update_roles",
+        {
             "did_id": did_id,
             "public_key": public_key,
             "roles": roles,
             "did_signature": did_signature,
         },
     )
-    extrinsic = substrate.create_signed_extrinsic(call=call, keypair=account)
-    return substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
+
+
+def update_roles(
+    substrate: SubstrateInterface,
+    account,
+    did_id: bytes,
+    public_key: bytes,
+    roles: list[str],
+    did_signature: bytes,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    call = compose_update_roles(substrate, did_id, public_key, roles, did_signature)
+    return _submit(substrate, account, call, wait, immortal)
+
+
+WORKFLOW_COMPOSERS = {
+    "create_did": compose_create_did,
+    "add_key": compose_add_key,
+    "revoke_key": compose_revoke_key,
+    "deactivate_did": compose_deactivate_did,
+    "register_schema": compose_register_schema,
+    "deprecate_schema": compose_deprecate_schema,
+    "add_service": compose_add_service,
+    "remove_service": compose_remove_service,
+    "set_metadata": compose_set_metadata,
+    "remove_metadata": compose_remove_metadata,
+    "rotate_key": compose_rotate_key,
+    "update_roles": compose_update_roles,
+}
+
+
+def _step_statuses(receipt, step_count: int) -> list[bool]:
+    if not receipt.is_success:
+        return [False] * step_count
+    completed = step_count
+    for event in receipt.triggered_events:
+        value = event.value
+        if value["module_id"] == "Utility" and value["event_id"] == "BatchInterrupted":
+            completed = value["attributes"]["index"]
+    return [index < completed for index in range(step_count)]
+
+
+def run_workflow(
+    substrate: SubstrateInterface,
+    account,
+    steps: list[tuple[str, dict]],
+    atomic: bool = True,
+    wait: WaitLevel = WaitLevel.IN_BLOCK,
+    immortal: bool = True,
+):
+    calls = []
+    for name, kwargs in steps:
+        composer = WORKFLOW_COMPOSERS.get(name)
+        if composer is None:
+            raise ValueError(f"Unknown workflow step '{name}'")
+        calls.append(composer(substrate, **kwargs))
+    receipt = submit_batch(substrate, account, calls, atomic, wait, immortal)
+    if wait in (WaitLevel.NONE, WaitLevel.BROADCAST):
+        return receipt, [None] * len(calls)
+    return receipt, _step_statuses(receipt, len(calls))
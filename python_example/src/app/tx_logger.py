@@ -1,21 +1,38 @@
+import sys
+
 LOG_TX = "🧾"
 LOG_WARN = "⚠️"
 LOG_EVENT = "📣"
 
 
+def log_hash(extrinsic_hash: str) -> None:
+    sys.stdout.write(f"{LOG_TX} Extrinsic hash: {extrinsic_hash}\n")
+
+
+def receipt_summary(receipt) -> list[tuple[str, str, object]]:
+    summary = []
+    append = summary.append
+    for event in receipt.triggered_events:
+        value = event.value
+        append((value["module_id"], value["event_id"], value["attributes"]))
+    return summary
+
+
 def log_receipt(receipt) -> None:
-    print(f"{LOG_TX} Extrinsic hash: {receipt.extrinsic_hash}")
-    if getattr(receipt, "block_hash", None):
-        print(f"{LOG_TX} Block hash: {receipt.block_hash}")
-    if getattr(receipt, "finalized_hash", None):
-        print(f"{LOG_TX} Finalized hash: {receipt.finalized_hash}")
+    lines = [f"{LOG_TX} Extrinsic hash: {receipt.extrinsic_hash}"]
+    append = lines.append
+    block_hash = getattr(receipt, "block_hash", None)
+    if block_hash:
+        append(f"{LOG_TX} Block hash: {block_hash}")
+    finalized_hash = getattr(receipt, "finalized_hash", None)
+    if finalized_hash:
+        append(f"{LOG_TX} Finalized hash: {finalized_hash}")
     is_success = getattr(receipt, "is_success", None)
     if is_success is None:
         is_success = getattr(receipt, "success", True)
-    print(f"{LOG_TX} Success: {is_success}")
+    append(f"{LOG_TX} Success: {is_success}")
     if not is_success:
-        print(f"{LOG_WARN} Error: {receipt.error_message}")
-    for event in receipt.triggered_events:
-        module = event.value.get("module_id")
-        name = event.value.get("event_id")
-        print(f"{LOG_EVENT} Event: {module}.{name} {event.params}")
+        append(f"{LOG_WARN} Error: {receipt.error_message}")
+    for module, name, params in receipt_summary(receipt):
+        append(f"{LOG_EVENT} Event: {module}.{name} {params}")
+    sys.stdout.write("\n".join(lines) + "\n")
@@ -0,0 +1,160 @@
+import pytest
+from scalecodec.base import ScaleBytes
+from substrateinterface import SubstrateInterface
+
+from app.scale import scale_compact_u32
+
+PRIMITIVE, SEQUENCE, VARIANT, COMPOSITE = 5, 2, 1, 0
+U8_PRIMITIVE = 3
+KEY_ROLES = [
+    "Authentication",
+    "AssertionMethod",
+    "KeyAgreement",
+    "CapabilityInvocation",
+    "CapabilityDelegation",
+]
+U8, BYTES, DID_CALL, KEY_ROLE, KEY_ROLES_VEC, RUNTIME_CALLS, RUNTIME_CALL = 0, 1, 2, 3, 4, 5, 6
+UTILITY_CALL, SERVICE, METADATA_ENTRY, SCHEMA_CALL = 7, 8, 9, 10
+DID_CALLS = [
+    ("create_did", [("public_key", BYTES), ("did_signature", BYTES)]),
+    (
+        "add_key",
+        [("did_id", BYTES), ("public_key", BYTES), ("roles", KEY_ROLES_VEC), ("did_signature", BYTES)],
+    ),
+    ("revoke_key", [("did_id", BYTES), ("public_key", BYTES), ("did_signature", BYTES)]),
+    ("deactivate_did", [("did_id", BYTES), ("did_signature", BYTES)]),
+    ("add_service", [("did_id", BYTES), ("service", SERVICE), ("did_signature", BYTES)]),
+    ("remove_service", [("did_id", BYTES), ("service_id", BYTES), ("did_signature", BYTES)]),
+    ("set_metadata", [("did_id", BYTES), ("entry", METADATA_ENTRY), ("did_signature", BYTES)]),
+    ("remove_metadata", [("did_id", BYTES), ("key", BYTES), ("did_signature", BYTES)]),
+    (
+        "rotate_key",
+        [
+            ("did_id", BYTES),
+            ("old_public_key", BYTES),
+            ("new_public_key", BYTES),
+            ("roles", KEY_ROLES_VEC),
+            ("did_signature", BYTES),
+        ],
+    ),
+    (
+        "update_roles",
+        [("did_id", BYTES), ("public_key", BYTES), ("roles", KEY_ROLES_VEC), ("did_signature", BYTES)],
+    ),
+]
+SCHEMA_CALLS = [
+    (
+        "register_schema",
+        [("schema_json", BYTES), ("schema_uri", BYTES), ("issuer_did", BYTES), ("did_signature", BYTES)],
+    ),
+    ("deprecate_schema", [("schema_id", BYTES), ("issuer_did", BYTES), ("did_signature", BYTES)]),
+]
+
+
+def _vec(items: list[bytes]) -> bytes:
+    return scale_compact_u32(len(items)) + b"".join(items)
+
+
+def _text(value: str) -> bytes:
+    return scale_compact_u32(len(value)) + value.encode()
+
+
+def _option(value: bytes | None) -> bytes:
+    return b"\x00" if value is None else b"\x01" + value
+
+
+def _field(name: str | None, type_id: int, type_name: str) -> bytes:
+    field_name = _option(None if name is None else _text(name))
+    return field_name + scale_compact_u32(type_id) + _option(_text(type_name)) + _vec([])
+
+
+def _variant(name: str, fields: list[bytes], index: int) -> bytes:
+    return _text(name) + _vec(fields) + bytes([index]) + _vec([])
+
+
+def _type(type_id: int, path: list[str], definition: bytes) -> bytes:
+    type_path = _vec([_text(part) for part in path])
+    return scale_compact_u32(type_id) + type_path + _vec([]) + definition + _vec([])
+
+
+def _calls(calls) -> bytes:
+    return bytes([VARIANT]) + _vec(
+        [
+            _variant(name, [_field(arg, type_id, "Vec<u8>") for arg, type_id in fields], index)
+            for index, (name, fields) in enumerate(calls)
+        ]
+    )
+
+
+def _pallet(name: str, calls_type: int, index: int) -> bytes:
+    calls = _option(scale_compact_u32(calls_type))
+    return _text(name) + b"\x00" + calls + b"\x00" + _vec([]) + b"\x00" + bytes([index])
+
+
+def _metadata_v14() -> bytes:
+    runtime_call = _vec(
+        [
+            _variant("Did", [_field(None, DID_CALL, "Call")], 42),
+            _variant("Utility", [_field(None, UTILITY_CALL, "Call")], 7),
+            _variant("Schema", [_field(None, SCHEMA_CALL, "Call")], 43),
+        ]
+    )
+    utility_calls = _vec(
+        [
+            _variant("batch", [_field("calls", RUNTIME_CALLS, "Vec<RuntimeCall>")], 0),
+            _variant("batch_all", [_field("calls", RUNTIME_CALLS, "Vec<RuntimeCall>")], 2),
+        ]
+    )
+    types = [
+        _type(U8, [], bytes([PRIMITIVE, U8_PRIMITIVE])),
+        _type(BYTES, [], bytes([SEQUENCE]) + scale_compact_u32(U8)),
+        _type(DID_CALL, ["pallet_did", "pallet", "Call"], _calls(DID_CALLS)),
+        _type(
+            KEY_ROLE,
+            ["pallet_did", "KeyRole"],
+            bytes([VARIANT]) + _vec([_variant(role, [], index) for index, role in enumerate(KEY_ROLES)]),
+        ),
+        _type(KEY_ROLES_VEC, [], bytes([SEQUENCE]) + scale_compact_u32(KEY_ROLE)),
+        _type(RUNTIME_CALLS, [], bytes([SEQUENCE]) + scale_compact_u32(RUNTIME_CALL)),
+        _type(RUNTIME_CALL, ["runtime", "RuntimeCall"], bytes([VARIANT]) + runtime_call),
+        _type(UTILITY_CALL, ["pallet_utility", "pallet", "Call"], bytes([VARIANT]) + utility_calls),
+        _type(
+            SERVICE,
+            ["pallet_did", "Service"],
+            bytes([COMPOSITE])
+            + _vec([_field(name, BYTES, "Vec<u8>") for name in ("id", "service_type", "endpoint")]),
+        ),
+        _type(
+            METADATA_ENTRY,
+            ["pallet_did", "MetadataEntry"],
+            bytes([COMPOSITE]) + _vec([_field(name, BYTES, "Vec<u8>") for name in ("key", "value")]),
+        ),
+        _type(SCHEMA_CALL, ["pallet_schema", "pallet", "Call"], _calls(SCHEMA_CALLS)),
+    ]
+    pallets = [
+        _pallet("Did", DID_CALL, 42),
+        _pallet("Utility", UTILITY_CALL, 7),
+        _pallet("Schema", SCHEMA_CALL, 43),
+    ]
+    extrinsic = scale_compact_u32(0) + b"\x04" + _vec([])
+    return b"meta\x0e" + _vec(types) + _vec(pallets) + extrinsic + scale_compact_u32(0)
+
+
+@pytest.fixture
+def substrate():
+    substrate = SubstrateInterface(
+        url="http://127.0.0.1:1",
+        ss58_format=42,
+        type_registry_preset="legacy",
+        auto_discover=False,
+    )
+    metadata = substrate.runtime_config.create_scale_object(
+        "MetadataVersioned", data=ScaleBytes(_metadata_v14())
+    )
+    metadata.decode()
+    substrate.metadata = metadata
+    substrate.runtime_version = 1
+    substrate.runtime_config.add_portable_registry(metadata)
+    substrate.runtime_config.set_active_spec_version_id(1)
+    substrate.init_runtime = lambda *args, **kwargs: None
+    return substrate
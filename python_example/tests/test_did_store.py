@@ -0,0 +1,44 @@
+import pytest
+from cryptography.fernet import InvalidToken
+
+from app import did_store
+from app.did_store import KDF_PBKDF2_SHA256, KDF_SCRYPT, decrypt_private_key, encrypt_private_key
+
+PRIVATE_KEY = bytes(range(32))
+PASSWORD = "correct horse"
+SALT = b"\x01" * 16
+
+
+def test_default_kdf_round_trips():
+    record = encrypt_private_key(PRIVATE_KEY, PASSWORD, SALT)
+    assert decrypt_private_key(record, PASSWORD, SALT) == PRIVATE_KEY
+    assert decrypt_private_key(record, PASSWORD, SALT, KDF_SCRYPT) == PRIVATE_KEY
+
+
+def test_decrypt_pbkdf2_record_needs_its_kdf():
+    record = encrypt_private_key(PRIVATE_KEY, PASSWORD, SALT, KDF_PBKDF2_SHA256)
+    assert decrypt_private_key(record, PASSWORD, SALT, KDF_PBKDF2_SHA256) == PRIVATE_KEY
+    with pytest.raises(InvalidToken):
+        decrypt_private_key(record, PASSWORD, SALT)
+
+
+def test_kdf_cache_does_not_keep_password():
+    encrypt_private_key(PRIVATE_KEY, PASSWORD, SALT, KDF_PBKDF2_SHA256)
+    for salt, digest, _ in did_store._KDF_KEY_CACHE:
+        assert salt == SALT
+        assert PASSWORD.encode("utf-8") not in digest
+        assert len(digest) == 32
+
+
+def test_kdf_cache_misses_on_shifted_salt_and_password():
+    record = encrypt_private_key(PRIVATE_KEY, "bc", b"a" * 16 + b"x", KDF_PBKDF2_SHA256)
+    with pytest.raises(InvalidToken):
+        decrypt_private_key(record, "c", b"a" * 16 + b"xb", KDF_PBKDF2_SHA256)
+
+
+def test_kdf_cache_misses_on_other_salt_or_password():
+    record = encrypt_private_key(PRIVATE_KEY, PASSWORD, SALT, KDF_PBKDF2_SHA256)
+    with pytest.raises(InvalidToken):
+        decrypt_private_key(record, PASSWORD, b"\x02" * 16, KDF_PBKDF2_SHA256)
+    with pytest.raises(InvalidToken):
+        decrypt_private_key(record, PASSWORD + "!", SALT, KDF_PBKDF2_SHA256)
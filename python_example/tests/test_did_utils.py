@@ -0,0 +1,32 @@
+import hashlib
+
+import pytest
+
+from app import did_utils
+
+BLAKE2B_256_ABC = "bddd813c634239723171ef3fee98579b94964e3bb1cb3e427262c8c068d52319"
+GENESIS_HASH = "0x" + "11" * 32
+INPUTS = [b"", b"abc", bytes(range(256)) * 8]
+
+
+def test_blake2b32_known_answer():
+    assert did_utils._blake2b32(b"abc").hex() == BLAKE2B_256_ABC
+
+
+@pytest.mark.parametrize("data", INPUTS)
+def test_blake2b32_matches_hashlib(data):
+    assert did_utils._blake2b32(data) == hashlib.blake2b(data, digest_size=32).digest()
+
+
+@pytest.mark.skipif(did_utils._LIBB2_BLAKE2B is None, reason="libb2 not installed")
+@pytest.mark.parametrize("data", INPUTS)
+def test_libb2_binding_matches_hashlib(data):
+    out = did_utils.ctypes.create_string_buffer(32)
+    assert did_utils._LIBB2_BLAKE2B(out, data, None, 32, len(data), 0) == 0
+    assert out.raw == hashlib.blake2b(data, digest_size=32).digest()
+
+
+@pytest.mark.parametrize("data", INPUTS)
+def test_prefixed_blake2b32_matches_hashlib(data):
+    expected = hashlib.blake2b(b"QSB_DID" + bytes.fromhex(GENESIS_HASH[2:]) + data, digest_size=32).digest()
+    assert did_utils._prefixed_blake2b32(b"QSB_DID", GENESIS_HASH, data) == expected
@@ -1,7 +1,76 @@
-from app.main import main
+import json
+
+import pytest
+from pqcrypto.sign.ml_dsa_44 import PUBLIC_KEY_SIZE
+
+from app import main as main_module
+from app.main import (
+    DID_ADD_KEY_PREFIX,
+    DID_REMOVE_METADATA_PREFIX,
+    DID_SET_METADATA_PREFIX,
+    _compact_len,
+    _print_did_document,
+    build_add_key_payload,
+    build_remove_metadata_payload,
+    build_set_metadata_payload,
+    main,
+)
+from app.scale import scale_compact_u32
 
 
 def test_main(capsys):
     main()
     captured = capsys.readouterr()
     assert "Hello from python_example" in captured.out
+
+
+@pytest.mark.parametrize("length", [0, 63, 64, 2**14 - 1, 2**14, PUBLIC_KEY_SIZE])
+def test_compact_len_matches_scale_compact_u32(length):
+    assert _compact_len(length) == scale_compact_u32(length)
+
+
+def test_compact_len_rejects_big_mode():
+    with pytest.raises(ValueError):
+        _compact_len(2**30)
+
+
+def test_build_payloads_known_answers():
+    did_id = b"d" * 32
+    public_key = b"k" * PUBLIC_KEY_SIZE
+    assert build_remove_metadata_payload(did_id, b"key") == (
+        DID_REMOVE_METADATA_PREFIX + b"\x80" + did_id + b"\x0c" + b"key"
+    )
+    assert build_add_key_payload(did_id, public_key, ["AssertionMethod", "CapabilityDelegation"]) == (
+        DID_ADD_KEY_PREFIX
+        + b"\x80"
+        + did_id
+        + scale_compact_u32(PUBLIC_KEY_SIZE)
+        + public_key
+        + b"\x08\x01\x04"
+    )
+    value = b"v" * 2**14
+    assert build_set_metadata_payload(did_id, b"", value) == (
+        DID_SET_METADATA_PREFIX + b"\x80" + did_id + b"\x00" + bytes.fromhex("02000100") + value
+    )
+
+
+DID_DOCUMENT = {
+    "id": "did:qsb:example",
+    "service": [{"id": "service-1", "endpoint": "https://example.com/\ufffd"}],
+    "metadata": {},
+}
+
+
+def test_print_did_document_keeps_the_indent_2_layout(capsys):
+    pytest.importorskip("orjson")
+    _print_did_document(DID_DOCUMENT)
+    out = capsys.readouterr().out
+    assert out == json.dumps(DID_DOCUMENT, indent=2, ensure_ascii=False) + "\n"
+    assert "\ufffd" in out
+    assert "\\ufffd" not in out
+
+
+def test_print_did_document_without_orjson_escapes_non_ascii(capsys, monkeypatch):
+    monkeypatch.setattr(main_module, "orjson", None)
+    _print_did_document(DID_DOCUMENT)
+    assert capsys.readouterr().out == json.dumps(DID_DOCUMENT, indent=2) + "\n"
@@ -0,0 +1,23 @@
+import pytest
+
+from app.scale import scale_compact_u32
+
+
+@pytest.mark.parametrize(
+    ("value", "encoded"),
+    [
+        (0, "00"),
+        (63, "fc"),
+        (64, "0101"),
+        (2**14 - 1, "fdff"),
+        (2**14, "02000100"),
+        (2**30 - 1, "feffffff"),
+    ],
+)
+def test_scale_compact_u32_known_answers(value, encoded):
+    assert scale_compact_u32(value).hex() == encoded
+
+
+def test_scale_compact_u32_rejects_big_mode():
+    with pytest.raises(ValueError):
+        scale_compact_u32(2**30)
@@ -0,0 +1,600 @@
+import json
+import threading
+
+import pytest
+from substrateinterface import Keypair, KeypairType
+from substrateinterface.exceptions import SubstrateRequestException
+from substrateinterface.transport import websocket as websocket_transport
+from websocket import WebSocketConnectionClosedException
+
+from app import substrate_client
+from app.substrate_client import (
+    MetadataFileCache,
+    NonceManager,
+    OrjsonCodec,
+    OrjsonWebsocketTransport,
+    PartialSubmission,
+    WaitLevel,
+    _compose,
+    _sign_all,
+)
+from app.tx_logger import LOG_TX, log_hash
+
+DID_ID = b"did:qsb:example"
+PUBLIC_KEY = b"\x01" * 1312
+SIGNATURE = b"\x02" * 2420
+CALLS = [
+    ("Did", "create_did", {"public_key": PUBLIC_KEY, "did_signature": SIGNATURE}),
+    (
+        "Did",
+        "add_key",
+        {
+            "did_id": DID_ID,
+            "public_key": PUBLIC_KEY,
+            "roles": ["AssertionMethod", "CapabilityDelegation"],
+            "did_signature": SIGNATURE,
+        },
+    ),
+    (
+        "Did",
+        "rotate_key",
+        {
+            "did_id": DID_ID,
+            "old_public_key": PUBLIC_KEY,
+            "new_public_key": PUBLIC_KEY,
+            "roles": [],
+            "did_signature": SIGNATURE,
+        },
+    ),
+    (
+        "Did",
+        "add_service",
+        {
+            "did_id": DID_ID,
+            "service": {
+                "id": b"service-1",
+                "service_type": b"ExampleService",
+                "endpoint": b"https://example.com",
+            },
+            "did_signature": SIGNATURE,
+        },
+    ),
+    (
+        "Schema",
+        "register_schema",
+        {"schema_json": b"{}" * 40, "schema_uri": b"", "issuer_did": DID_ID, "did_signature": SIGNATURE},
+    ),
+]
+
+
+def test_orjson_codec_round_trip():
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "author_submitExtrinsic",
+        "params": ["0x" + "ab" * 4096, 2**70],
+        "id": 7,
+    }
+    assert OrjsonCodec.loads(OrjsonCodec.dumps(payload)) == payload
+    message = json.dumps({"jsonrpc": "2.0", "result": {"free": 2**100, "dev": True}, "id": 1})
+    assert OrjsonCodec.loads(message) == json.loads(message)
+
+
+
+class FakeWebsocket:
+    def __init__(self, responses):
+        self.sent = []
+        self.responses = list(responses)
+
+    def send(self, message):
+        self.sent.append(message)
+
+    def recv(self):
+        return self.responses.pop(0)
+
+
+def test_orjson_transport_is_scoped_to_its_instance():
+    websocket = FakeWebsocket(
+        [
+            json.dumps({"jsonrpc": "2.0", "result": "0xother", "id": 6}),
+            json.dumps({"jsonrpc": "2.0", "result": {"free": 2**100}, "id": 7}),
+        ]
+    )
+    transport = OrjsonWebsocketTransport(websocket=websocket)
+    payload = {"jsonrpc": "2.0", "method": "state_getStorage", "params": ["0x" + "ab" * 64], "id": 7}
+    assert transport.rpc_request(payload) == {"jsonrpc": "2.0", "result": {"free": 2**100}, "id": 7}
+    assert json.loads(websocket.sent[0]) == payload
+    assert websocket_transport.json is json
+
+
+def _assert_same_call(fast, reference):
+    assert fast.data.to_hex() == reference.data.to_hex()
+    assert fast.call_hash == reference.call_hash
+    assert fast.value == reference.value
+
+
+@pytest.mark.parametrize(("module", "function", "params"), CALLS)
+def test_compose_matches_compose_call(substrate, module, function, params):
+    _assert_same_call(
+        _compose(substrate, module, function, dict(params)),
+        substrate.compose_call(module, function, dict(params)),
+    )
+
+
+@pytest.mark.parametrize("wrap", [bytearray, memoryview])
+def test_compose_accepts_bytes_like(substrate, wrap):
+    params = {"did_id": wrap(DID_ID), "key": wrap(b"profile"), "did_signature": wrap(SIGNATURE)}
+    reference = substrate.compose_call(
+        "Did",
+        "remove_metadata",
+        {"did_id": DID_ID, "key": b"profile", "did_signature": SIGNATURE},
+    )
+    _assert_same_call(_compose(substrate, "Did", "remove_metadata", params), reference)
+
+
+def test_compose_rejects_unknown_role(substrate):
+    params = {"did_id": DID_ID, "public_key": PUBLIC_KEY, "roles": ["Owner"], "did_signature": SIGNATURE}
+    with pytest.raises(ValueError):
+        _compose(substrate, "Did", "update_roles", params)
+
+
+@pytest.mark.parametrize("function", ["batch", "batch_all"])
+def test_compose_batch_matches_compose_call(substrate, function):
+    fast_calls = [_compose(substrate, module, name, dict(params)) for module, name, params in CALLS]
+    reference_calls = [substrate.compose_call(module, name, dict(params)) for module, name, params in CALLS]
+    fast = _compose(substrate, "Utility", function, {"calls": fast_calls})
+    reference = substrate.compose_call("Utility", function, {"calls": reference_calls})
+    assert fast.data.to_hex() == reference.data.to_hex()
+    assert fast.call_hash == reference.call_hash
+
+
+def _record_signed_extrinsics(substrate):
+    signed = []
+    substrate.get_block_hash = lambda block_id=None: "0x" + "11" * 32
+    substrate.create_signed_extrinsic = lambda **kwargs: signed.append(kwargs) or kwargs
+    return signed
+
+
+def test_sign_all_signs_payloads_up_front(substrate):
+    signed = _record_signed_extrinsics(substrate)
+    account = Keypair.create_from_seed("0x" + "22" * 32, crypto_type=KeypairType.ED25519)
+    calls = [
+        _compose(substrate, "Did", "deactivate_did", {"did_id": DID_ID, "did_signature": bytes([index])})
+        for index in range(3)
+    ]
+    _sign_all(substrate, account, calls, [5, 6, 7])
+    for kwargs, call, nonce in zip(signed, calls, [5, 6, 7]):
+        payload = substrate.generate_signature_payload(call=call, era="00", nonce=nonce, tip=0)
+        assert kwargs["nonce"] == nonce
+        assert kwargs["signature"] == account.sign(payload)
+
+
+def test_sign_all_lets_library_sign_ecdsa(substrate):
+    signed = _record_signed_extrinsics(substrate)
+    account = Keypair.create_from_private_key("0x" + "33" * 32, crypto_type=KeypairType.ECDSA)
+    calls = [_compose(substrate, "Did", "deactivate_did", {"did_id": DID_ID, "did_signature": b"s"})] * 2
+    _sign_all(substrate, account, calls, [1, 2])
+    assert [kwargs["nonce"] for kwargs in signed] == [1, 2]
+    assert all("signature" not in kwargs for kwargs in signed)
+
+
+class _HashOnlySubstrate:
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def rpc_request(self, method, params):
+        self.requests.append((method, params))
+        return self.response
+
+    def submit_extrinsic(self, extrinsic, **kwargs):
+        raise AssertionError("WaitLevel.NONE must not build a receipt")
+
+
+class _SignedExtrinsic:
+    data = "0x1234"
+
+
+def test_wait_level_none_returns_the_submitted_hash(capsys):
+    substrate = _HashOnlySubstrate({"jsonrpc": "2.0", "result": "0xabcd", "id": 1})
+    extrinsic_hash = substrate_client.submit_with_timeout(substrate, _SignedExtrinsic(), WaitLevel.NONE)
+    assert extrinsic_hash == "0xabcd"
+    assert substrate.requests == [("author_submitExtrinsic", ["0x1234"])]
+    log_hash(extrinsic_hash)
+    assert capsys.readouterr().out == f"{LOG_TX} Extrinsic hash: 0xabcd\n"
+
+
+def test_wait_level_none_raises_rpc_errors():
+    error = {"code": 1014, "message": "Priority is too low"}
+    substrate = _HashOnlySubstrate({"jsonrpc": "2.0", "error": error, "id": 1})
+    with pytest.raises(SubstrateRequestException):
+        substrate_client.submit_with_timeout(substrate, _SignedExtrinsic(), WaitLevel.NONE)
+
+
+class _HangingWebsocket:
+    def __init__(self):
+        self.aborted = threading.Event()
+        self.closed = False
+
+    def abort(self):
+        self.aborted.set()
+
+    def close(self):
+        self.closed = True
+
+
+class _HangingSubstrate:
+    def __init__(self):
+        self.websocket = _HangingWebsocket()
+        self.checked_head_hash = "0xchecked"
+        self.reconnected = False
+
+    def submit_extrinsic(self, extrinsic, **kwargs):
+        self.websocket.aborted.wait(5)
+        raise WebSocketConnectionClosedException("aborted")
+
+    def connect_websocket(self):
+        assert self.websocket.closed
+        self.reconnected = True
+
+    def get_block_number(self, block_hash):
+        return {"0xchecked": 10, None: 13}[block_hash]
+
+
+class _Extrinsic:
+    extrinsic_hash = b"\xaa"
+
+
+def test_submit_timeout_aborts_socket_and_scans_from_checked_head(monkeypatch):
+    substrate = _HangingSubstrate()
+    scanned = []
+
+    def find_extrinsics(substrate, extrinsic_hashes, block_numbers):
+        scanned.append(block_numbers)
+        return {"0xaa": "receipt"}
+
+    monkeypatch.setattr(substrate_client, "_find_extrinsics", find_extrinsics)
+    awaited = []
+
+    def await_inclusion(substrate, receipt, timeout, from_block):
+        awaited.append((timeout, from_block))
+        return receipt
+
+    monkeypatch.setattr(substrate_client, "await_inclusion", await_inclusion)
+    receipt = substrate_client.submit_with_timeout(substrate, _Extrinsic(), WaitLevel.IN_BLOCK, 0.05)
+    assert receipt == "receipt"
+    assert awaited[0][0] < 0.05
+    assert awaited[0][1] == 14
+    assert substrate.websocket.aborted.is_set()
+    assert substrate.reconnected
+    assert scanned == [range(10, 14)]
+
+
+class _Receipt:
+    def __init__(self, extrinsic_hash, from_block_hash=None):
+        self.extrinsic_hash = extrinsic_hash
+        self.block_hash = None
+        self.from_block_hash = from_block_hash
+
+
+class _Chain:
+    def get_block_number(self, block_hash):
+        return {"0xold": 3, "0xnewer": 8, None: 20}[block_hash]
+
+
+def _record_scans(monkeypatch):
+    scanned = []
+
+    def find_extrinsics(substrate, extrinsic_hashes, block_numbers):
+        scanned.append(block_numbers)
+        return {extrinsic_hash: f"included {extrinsic_hash}" for extrinsic_hash in extrinsic_hashes}
+
+    monkeypatch.setattr(substrate_client, "_find_extrinsics", find_extrinsics)
+    return scanned
+
+
+def test_await_inclusion_scans_from_the_submission_block(monkeypatch):
+    scanned = _record_scans(monkeypatch)
+    receipts = [_Receipt("0x01", "0xnewer"), _Receipt("0x02", "0xold")]
+    results = substrate_client._await_included(_Chain(), receipts, 1.0)
+    assert results == ["included 0x01", "included 0x02"]
+    assert scanned == [range(3, 21)]
+
+
+def test_await_inclusion_honours_explicit_from_block(monkeypatch):
+    scanned = _record_scans(monkeypatch)
+    substrate_client.await_inclusion(_Chain(), _Receipt("0x01", "0xold"), 1.0, from_block=1)
+    assert scanned == [range(1, 21)]
+
+
+def test_await_inclusion_falls_back_to_lookback(monkeypatch):
+    scanned = _record_scans(monkeypatch)
+    substrate_client.await_inclusion(_Chain(), _Receipt("0x01"), 1.0)
+    assert scanned == [range(20 - substrate_client.INCLUSION_LOOKBACK_BLOCKS, 21)]
+
+
+GENESIS_HASH = "0x" + "ab" * 32
+OTHER_GENESIS_HASH = "0x" + "cd" * 32
+
+
+def _metadata_cache(substrate, tmp_path, genesis_hash=GENESIS_HASH):
+    substrate.get_block_hash = lambda block_id=None: genesis_hash
+    return MetadataFileCache(substrate, tmp_path)
+
+
+def test_metadata_cache_round_trips(substrate, tmp_path):
+    cache = _metadata_cache(substrate, tmp_path)
+    assert cache.get("METADATA_1") is None
+    cache.set("METADATA_1", substrate.metadata)
+    assert (tmp_path / GENESIS_HASH / "metadata_1.bin").is_file()
+    cached = cache.get("METADATA_1")
+    assert bytes(cached.data.data) == bytes(substrate.metadata.data.data)
+    assert cached.value == substrate.metadata.value
+
+
+def test_metadata_cache_is_scoped_to_the_genesis_hash(substrate, tmp_path):
+    _metadata_cache(substrate, tmp_path).set("METADATA_1", substrate.metadata)
+    assert _metadata_cache(substrate, tmp_path, OTHER_GENESIS_HASH).get("METADATA_1") is None
+
+
+def test_metadata_cache_ignores_a_corrupt_file(substrate, tmp_path):
+    cache = _metadata_cache(substrate, tmp_path)
+    path = tmp_path / GENESIS_HASH / "metadata_1.bin"
+    path.parent.mkdir()
+    path.write_bytes(bytes(substrate.metadata.data.data)[:-40])
+    assert cache.get("METADATA_1") is None
+
+
+class _Account:
+    ss58_address = "5Alice"
+
+
+class _SubmitReceipt:
+    def __init__(self, extrinsic):
+        self.extrinsic_hash = extrinsic
+
+
+class _NodeSubstrate:
+    def __init__(self, nonce=7, reject_at=None):
+        self.nonce = nonce
+        self.reject_at = reject_at
+        self.nonce_requests = 0
+        self.submitted = []
+        self.checked_head_hash = "0xhead"
+
+    def get_account_nonce(self, address):
+        self.nonce_requests += 1
+        return self.nonce
+
+    def submit_extrinsic(self, extrinsic, **kwargs):
+        if len(self.submitted) == self.reject_at:
+            raise SubstrateRequestException({"code": 1010, "message": "Invalid Transaction"})
+        self.submitted.append(extrinsic)
+        return _SubmitReceipt(extrinsic)
+
+
+def _sign_nonces(monkeypatch):
+    monkeypatch.setattr(
+        substrate_client,
+        "_sign_all",
+        lambda substrate, account, calls, nonces, immortal: [f"signed {nonce}" for nonce in nonces],
+    )
+
+
+def test_nonce_manager_counts_locally_and_resyncs():
+    substrate = _NodeSubstrate(nonce=7)
+    nonces = NonceManager(substrate, "5Alice")
+    assert [nonces.next() for _ in range(3)] == [7, 8, 9]
+    assert substrate.nonce_requests == 1
+    substrate.nonce = 20
+    nonces.resync()
+    assert nonces.next() == 20
+    assert substrate.nonce_requests == 2
+
+
+def test_submit_many_assigns_consecutive_nonces(monkeypatch):
+    _sign_nonces(monkeypatch)
+    substrate = _NodeSubstrate(nonce=7)
+    receipts = substrate_client.submit_many(
+        substrate, _Account(), ["a", "b", "c"], WaitLevel.BROADCAST, NonceManager(substrate, "5Alice")
+    )
+    assert [receipt.extrinsic_hash for receipt in receipts] == ["signed 7", "signed 8", "signed 9"]
+    assert {receipt.from_block_hash for receipt in receipts} == {"0xhead"}
+
+
+def test_submit_many_keeps_broadcast_receipts_on_rejection(monkeypatch):
+    _sign_nonces(monkeypatch)
+    substrate = _NodeSubstrate(nonce=7, reject_at=2)
+    nonces = NonceManager(substrate, "5Alice")
+    with pytest.raises(PartialSubmission) as excinfo:
+        substrate_client.submit_many(
+            substrate, _Account(), ["a", "b", "c", "d"], WaitLevel.BROADCAST, nonces
+        )
+    assert [receipt.extrinsic_hash for receipt in excinfo.value.receipts] == ["signed 7", "signed 8"]
+    assert isinstance(excinfo.value.__cause__, SubstrateRequestException)
+    assert substrate.nonce_requests == 2
+
+
+class _Event:
+    def __init__(self, module_id, event_id, attributes=None):
+        self.value = {"module_id": module_id, "event_id": event_id, "attributes": attributes}
+
+
+class _BatchReceipt:
+    def __init__(self, is_success=True, events=()):
+        self.is_success = is_success
+        self.triggered_events = list(events)
+
+
+WORKFLOW_STEPS = [
+    ("create_did", {"public_key": PUBLIC_KEY, "did_signature": SIGNATURE}),
+    ("deactivate_did", {"did_id": DID_ID, "did_signature": SIGNATURE}),
+    ("deprecate_schema", {"schema_id": b"schema-1", "issuer_did": DID_ID, "did_signature": SIGNATURE}),
+]
+
+
+def _submit_batch_returning(monkeypatch, receipt):
+    submitted = []
+
+    def submit_batch(substrate, account, calls, atomic, wait, immortal):
+        submitted.append((len(calls), atomic, wait))
+        return receipt
+
+    monkeypatch.setattr(substrate_client, "submit_batch", submit_batch)
+    return submitted
+
+
+def test_run_workflow_reports_every_step_of_a_successful_batch(substrate, monkeypatch):
+    receipt = _BatchReceipt(events=[_Event("Utility", "BatchCompleted")])
+    submitted = _submit_batch_returning(monkeypatch, receipt)
+    assert substrate_client.run_workflow(substrate, _Account(), WORKFLOW_STEPS) == (receipt, [True] * 3)
+    assert submitted == [(3, True, WaitLevel.IN_BLOCK)]
+
+
+def test_run_workflow_fails_every_step_of_a_failed_batch_all(substrate, monkeypatch):
+    receipt = _BatchReceipt(is_success=False)
+    _submit_batch_returning(monkeypatch, receipt)
+    assert substrate_client.run_workflow(substrate, _Account(), WORKFLOW_STEPS) == (receipt, [False] * 3)
+
+
+def test_run_workflow_stops_at_the_interrupted_step(substrate, monkeypatch):
+    events = [
+        _Event("Utility", "ItemCompleted"),
+        _Event("Utility", "BatchInterrupted", {"index": 1, "error": "BadOrigin"}),
+    ]
+    receipt = _BatchReceipt(events=events)
+    submitted = _submit_batch_returning(monkeypatch, receipt)
+    _, statuses = substrate_client.run_workflow(substrate, _Account(), WORKFLOW_STEPS, atomic=False)
+    assert statuses == [True, False, False]
+    assert submitted == [(3, False, WaitLevel.IN_BLOCK)]
+
+
+@pytest.mark.parametrize("wait", [WaitLevel.NONE, WaitLevel.BROADCAST])
+def test_run_workflow_leaves_statuses_unknown_without_inclusion(substrate, monkeypatch, wait):
+    _submit_batch_returning(monkeypatch, "0xabcd")
+    result = substrate_client.run_workflow(substrate, _Account(), WORKFLOW_STEPS, wait=wait)
+    assert result == ("0xabcd", [None] * 3)
+
+
+def test_run_workflow_rejects_unknown_steps(substrate, monkeypatch):
+    submitted = _submit_batch_returning(monkeypatch, _BatchReceipt())
+    with pytest.raises(ValueError, match="Unknown workflow step 'transfer'"):
+        substrate_client.run_workflow(substrate, _Account(), WORKFLOW_STEPS + [("transfer", {})])
+    assert submitted == []
+
+
+def _submit_responses(monkeypatch, responses):
+    signed = []
+    submitted = []
+
+    def sign(substrate, account, call, nonce=None, immortal=True):
+        signed.append(nonce)
+        return f"signed {nonce}"
+
+    def submit_with_timeout(substrate, extrinsic, wait):
+        submitted.append(extrinsic)
+        response = responses.pop(0)
+        if callable(response):
+            response = response()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(substrate_client, "_sign", sign)
+    monkeypatch.setattr(substrate_client, "submit_with_timeout", submit_with_timeout)
+    return signed, submitted
+
+
+def test_submit_resyncs_and_retries_once_on_a_nonce_error(monkeypatch):
+    substrate = _NodeSubstrate(nonce=7)
+    stale = SubstrateRequestException({"code": 1014, "message": "Priority is too low"})
+
+    def included_elsewhere():
+        substrate.nonce = 8
+        return stale
+
+    signed, submitted = _submit_responses(monkeypatch, [included_elsewhere, "receipt"])
+    assert substrate_client._submit(substrate, _Account(), "call") == "receipt"
+    assert signed == [7, 8]
+    assert submitted == ["signed 7", "signed 8"]
+    assert substrate.nonce_requests == 2
+
+
+def test_submit_does_not_retry_a_second_nonce_error(monkeypatch):
+    substrate = _NodeSubstrate(nonce=7)
+    stale = SubstrateRequestException({"code": 1014, "message": "Priority is too low"})
+    signed, _ = _submit_responses(monkeypatch, [stale, stale])
+    with pytest.raises(SubstrateRequestException):
+        substrate_client._submit(substrate, _Account(), "call")
+    assert len(signed) == 2
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        SubstrateRequestException({"code": 1010, "message": "Invalid Transaction"}),
+        substrate_client.SubmissionTimeout("not included"),
+    ],
+)
+def test_submit_resyncs_then_raises_other_errors(monkeypatch, error):
+    substrate = _NodeSubstrate(nonce=7)
+    signed, _ = _submit_responses(monkeypatch, [error])
+    with pytest.raises(type(error)):
+        substrate_client._submit(substrate, _Account(), "call")
+    assert signed == [7]
+    assert substrate.nonce_requests == 2
+
+
+class _AccountInfo:
+    def __init__(self, free):
+        self.value = {"data": {"free": free}}
+
+
+class _StorageKey:
+    def __init__(self, address):
+        self.address = address
+
+    def to_hex(self):
+        return f"0x{self.address.encode().hex()}"
+
+
+class _BalanceSubstrate:
+    def __init__(self, balances):
+        self.balances = balances
+        self.queries = []
+
+    def query(self, module, storage_function, params):
+        self.queries.append(tuple(params))
+        return _AccountInfo(self.balances[params[0]])
+
+    def create_storage_key(self, pallet, storage_function, params):
+        return _StorageKey(params[0])
+
+    def query_multi(self, storage_keys):
+        self.queries.append(tuple(key.address for key in storage_keys))
+        return [
+            (_StorageKey(key.address), _AccountInfo(self.balances[key.address])) for key in storage_keys
+        ]
+
+
+def test_free_balance_is_cached_until_it_expires_or_is_forgotten():
+    substrate = _BalanceSubstrate({"5Alice": 100})
+    assert substrate_client.get_free_balance(substrate, "5Alice") == 100
+    substrate.balances["5Alice"] = 90
+    assert substrate_client.get_free_balance(substrate, "5Alice") == 100
+    assert substrate_client.get_free_balance(substrate, "5Alice", max_age=0) == 90
+    substrate.balances["5Alice"] = 80
+    substrate_client._forget_balance(substrate, "5Alice")
+    assert substrate_client.get_free_balance(substrate, "5Alice") == 80
+    assert substrate.queries == [("5Alice",)] * 3
+
+
+def test_free_balances_query_only_uncached_addresses_in_chunks(monkeypatch):
+    monkeypatch.setattr(substrate_client, "BALANCE_QUERY_CHUNK_SIZE", 2)
+    substrate = _BalanceSubstrate({"5Alice": 100, "5Bob": 200, "5Carol": 300, "5Dave": 400})
+    assert substrate_client.get_free_balance(substrate, "5Alice") == 100
+    balances = substrate_client.get_free_balances(substrate, ["5Bob", "5Alice", "5Carol", "5Bob", "5Dave"])
+    assert balances == {"5Alice": 100, "5Bob": 200, "5Carol": 300, "5Dave": 400}
+    assert substrate.queries == [("5Alice",), ("5Bob", "5Carol"), ("5Dave",)]
+    substrate.balances["5Dave"] = 0
+    assert substrate_client.get_free_balance(substrate, "5Dave") == 400
+    assert substrate_client.get_free_balances(substrate, ["5Dave"], max_age=0) == {"5Dave": 0}